@@ -0,0 +1,251 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask import g, request
+
+from metrics import metrics
+
+# Endpoints that are never shed: probes, and the event stream, which holds
+# its request open for as long as the client stays connected.
+EXEMPT_ENDPOINTS = {"index", "health", "get_metrics", "stream_events"}
+
+
+def route_group(req):
+    if req.endpoint is None or req.endpoint in EXEMPT_ENDPOINTS:
+        return None
+    if req.path.startswith(("/api/analytics/", "/api/export/")):
+        return "analytics"
+    if req.method in ("POST", "PUT", "DELETE"):
+        return "writes"
+    if req.method == "GET" and not req.view_args:
+        return "lists"
+    return None
+
+
+def parse_limits(spec):
+    # "analytics=4:8,lists=8:16" -> {"analytics": (4, 8), "lists": (8, 16)}:
+    # at most 4 analytics requests run at once and 8 more may wait.
+    limits = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, sizes = part.partition("=")
+        running, _, waiting = sizes.partition(":")
+        limits[name.strip()] = (int(running), int(waiting or 0))
+    return limits
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Limiter:
+    # Caps for one worker process. acquire() returns a ticket for release(),
+    # or None when the request is turned away.
+
+    def __init__(self, name, running, waiting, timeout):
+        self.name = name
+        self.running = running
+        self.waiting = waiting
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(running)
+        self._queued = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._queued >= self.waiting:
+                    return None
+                self._queued += 1
+            metrics.incr(f"admission.{self.name}.queued")
+            try:
+                if not self._slots.acquire(timeout=self.timeout):
+                    metrics.incr(f"admission.{self.name}.timed_out")
+                    return None
+            finally:
+                with self._lock:
+                    self._queued -= 1
+        with self._lock:
+            self._active += 1
+        return True
+
+    def release(self, ticket):
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._active,
+                "queued": self._queued,
+                "max_running": self.running,
+                "max_queued": self.waiting,
+            }
+
+
+class SharedLimiter:
+    # The same caps counted across every worker process on the host. Each
+    # running or waiting request is a row in the shared SQLite file, tagged
+    # with its pid, so rows left by a worker that died are reclaimed by the
+    # next caller.
+
+    def __init__(self, path, name, running, waiting, timeout, poll_interval=0.02):
+        self.path = path
+        self.name = name
+        self.running = running
+        self.waiting = waiting
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._connect().execute(
+            """
+            CREATE TABLE IF NOT EXISTS admission_slots (
+                ticket TEXT PRIMARY KEY,
+                grp TEXT NOT NULL,
+                state TEXT NOT NULL,
+                pid INTEGER NOT NULL
+            )
+            """
+        )
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forks.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transact(self, fn):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def _counts(self, conn):
+        # Drops rows of dead workers first, then counts (running, queued).
+        for (pid,) in conn.execute("SELECT DISTINCT pid FROM admission_slots").fetchall():
+            if pid != os.getpid() and not _alive(pid):
+                conn.execute("DELETE FROM admission_slots WHERE pid = ?", (pid,))
+        counts = dict(conn.execute(
+            "SELECT state, COUNT(*) FROM admission_slots WHERE grp = ? GROUP BY state",
+            (self.name,),
+        ).fetchall())
+        return counts.get("running", 0), counts.get("queued", 0)
+
+    def acquire(self):
+        ticket = uuid.uuid4().hex
+
+        def enter(conn):
+            running, queued = self._counts(conn)
+            if running < self.running:
+                state = "running"
+            elif queued < self.waiting:
+                state = "queued"
+            else:
+                return None
+            conn.execute(
+                "INSERT INTO admission_slots (ticket, grp, state, pid) VALUES (?, ?, ?, ?)",
+                (ticket, self.name, state, os.getpid()),
+            )
+            return state
+
+        def promote(conn):
+            running, _ = self._counts(conn)
+            if running >= self.running:
+                return False
+            conn.execute("UPDATE admission_slots SET state = 'running' WHERE ticket = ?", (ticket,))
+            return True
+
+        state = self._transact(enter)
+        if state is None:
+            return None
+        if state == "queued":
+            metrics.incr(f"admission.{self.name}.queued")
+            deadline = time.monotonic() + self.timeout
+            while not self._transact(promote):
+                if time.monotonic() >= deadline:
+                    self.release(ticket)
+                    metrics.incr(f"admission.{self.name}.timed_out")
+                    return None
+                time.sleep(self.poll_interval)
+        return ticket
+
+    def release(self, ticket):
+        self._connect().execute("DELETE FROM admission_slots WHERE ticket = ?", (ticket,))
+
+    def stats(self):
+        running, queued = self._transact(self._counts)
+        return {
+            "running": running,
+            "queued": queued,
+            "max_running": self.running,
+            "max_queued": self.waiting,
+        }
+
+
+class AdmissionControl:
+    # Caps in-flight requests per route group, so a burst in one group
+    # (dashboards refreshing) can't take every worker from the others. Over
+    # the cap a request waits in a short bounded queue; past that it is
+    # turned away at once with a 503. With SHARED_CACHE_PATH set the caps
+    # hold across all worker processes on the host, otherwise per process.
+
+    def __init__(self, app):
+        timeout = app.config["ADMISSION_QUEUE_TIMEOUT"]
+        path = app.config["SHARED_CACHE_PATH"]
+        self.retry_after = str(app.config["ADMISSION_RETRY_AFTER"])
+        self.limiters = {
+            name: (
+                SharedLimiter(path, name, running, waiting, timeout)
+                if path else Limiter(name, running, waiting, timeout)
+            )
+            for name, (running, waiting) in parse_limits(app.config["ADMISSION_LIMITS"]).items()
+        }
+        if self.limiters:
+            app.before_request(self._admit)
+            app.teardown_request(self._release)
+
+    def _admit(self):
+        limiter = self.limiters.get(route_group(request))
+        if limiter is None:
+            return None
+        ticket = limiter.acquire()
+        if ticket is None:
+            metrics.incr(f"admission.{limiter.name}.rejected")
+            return (
+                {"error": "Server is busy, retry later", "group": limiter.name},
+                503,
+                {"Retry-After": self.retry_after},
+            )
+        metrics.incr(f"admission.{limiter.name}.admitted")
+        g.admission = (limiter, ticket)
+        return None
+
+    def _release(self, exc):
+        admitted = g.pop("admission", None)
+        if admitted is not None:
+            limiter, ticket = admitted
+            limiter.release(ticket)
+
+    def stats(self):
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
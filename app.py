@@ -1,28 +1,122 @@
+import math
 import os
-from datetime import datetime
-from flask import Flask, request, jsonify
+import queue
+import tempfile
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from itertools import chain
+import click
+from flask import Flask, Response, abort, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
-from sqlalchemy import func
-
+from sqlalchemy import case, func, lambda_stmt, literal, select, tuple_, union_all, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import with_polymorphic
+
+import cache
+from admission import AdmissionControl
+from archive import Archive, archive_tables
+from budgets import TimeBudgets, budget_exceeded, init_time_budgets
+from cache import cached, init_cache
+from census import daily_census
+from changefeed import change_row, change_to_dict, init_changefeed, record_changes
+from events import EventHub, format_sse, load_events
+from export import EXPORT_MODELS, FORMATS, ExportUnavailable, parse_after, write_export
+from forecasting import forecast
+from jobs import ANALYTICS_JOBS, JobRunner, QueueFull, job_to_dict
+from metrics import init_sql_metrics, metrics, statement_cache_hit_ratio
+from migrations import run_migrations
 from models import (
     db, Patient, Doctor, Nurse, Receptionist, Employee,
     Bill, Visit, Recommendation, Schedule, Resource,
-    Room, Medication
+    Room, Medication, Treatment, TreatmentStats, Job, ChangeLog
 )
+from rollups import init_rollups
+from sharding import ShardRouter
+from treatments import init_treatments, treatment_catalog
+from warmup import warm_up
 
 load_dotenv()
 
+# "* 1.0" keeps SQLite from truncating integer-valued sums in the division.
+avg_treatment_cost = (
+    TreatmentStats.Total_Sum * 1.0 / TreatmentStats.Bill_Count
+).label("avg_cost")
+
+PATIENT_ID_CHUNK = 500
+VISIT_PAGE_SIZE = 50
+PAYROLL_PERCENTILES = (25, 50, 75, 90)
+DATE_ARGS_ERROR = {"error": "from and to must be ISO dates (YYYY-MM-DD)"}
+
+# Bucket name -> first day of the bucket a date falls in.
+THROUGHPUT_BUCKETS = {
+    "day": lambda d: d,
+    "week": lambda d: d - timedelta(days=d.weekday()),
+    "month": lambda d: d.replace(day=1),
+}
+
 
 def create_app():
     app = Flask(__name__)
 
     
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///render_temp2.db"
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("HMS_DATABASE_URI", "sqlite:///render_temp2.db")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-    CORS(app)
+    app.config["ANALYTICS_CACHE_TTL"] = int(os.getenv("ANALYTICS_CACHE_TTL", "30"))
+    app.config["ANALYTICS_CACHE_SIZE"] = int(os.getenv("ANALYTICS_CACHE_SIZE", "128"))
+    app.config["SHARED_CACHE_PATH"] = os.getenv("SHARED_CACHE_PATH", "")
+    app.config["SHARED_CACHE_SIZE"] = int(os.getenv("SHARED_CACHE_SIZE", "1024"))
+    app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", "2"))
+    app.config["JOB_QUEUE_LIMIT"] = int(os.getenv("JOB_QUEUE_LIMIT", "16"))
+    app.config["JOB_RESULT_TTL"] = int(os.getenv("JOB_RESULT_TTL", "3600"))
+    # Longest a job may stay queued or running before it counts as abandoned.
+    app.config["JOB_LEASE"] = int(os.getenv("JOB_LEASE", "300"))
+    app.config["EVENT_POLL_INTERVAL"] = float(os.getenv("EVENT_POLL_INTERVAL", "1.0"))
+    # Each open stream holds a worker thread for its lifetime; keep this
+    # below the server's thread count so ordinary requests still get served.
+    app.config["EVENT_STREAM_LIMIT"] = int(os.getenv("EVENT_STREAM_LIMIT", "8"))
+    app.config["WARMUP"] = os.getenv("WARMUP", "1") == "1"
+    app.config["WARMUP_CONNECTIONS"] = int(os.getenv("WARMUP_CONNECTIONS", "5"))
+    app.config["NURSE_PATIENT_RATIO"] = int(os.getenv("NURSE_PATIENT_RATIO", "4"))
+    # Comma-separated database URIs for patient data; empty keeps everything
+    # on SQLALCHEMY_DATABASE_URI. The list order is part of the data layout.
+    # Patients already on the primary are moved with `flask shard-migrate`.
+    app.config["SHARD_URIS"] = [
+        uri.strip() for uri in os.getenv("HMS_SHARD_URIS", "").split(",") if uri.strip()
+    ]
+    app.config["ARCHIVE_URI"] = os.getenv("HMS_ARCHIVE_URI", "")
+    app.config["ARCHIVE_RETENTION_DAYS"] = int(os.getenv("ARCHIVE_RETENTION_DAYS", "730"))
+    # group=running:queued, host-wide when SHARED_CACHE_PATH is set (else per
+    # worker process); an empty value turns shedding off.
+    app.config["ADMISSION_LIMITS"] = os.getenv(
+        "ADMISSION_LIMITS", "analytics=2:4,lists=8:16,writes=16:32"
+    )
+    app.config["ADMISSION_QUEUE_TIMEOUT"] = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2.0"))
+    app.config["ADMISSION_RETRY_AFTER"] = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+    # Seconds of database time per request, by endpoint or route group; 0 = unlimited.
+    app.config["DB_TIME_BUDGETS"] = os.getenv(
+        "DB_TIME_BUDGETS", "default=5,analytics=20,export_table=0,create_tables=0"
+    )
+
+    # Pagination, export and back-off headers are read by the browser client.
+    CORS(app, expose_headers=["X-Next-Cursor", "X-Export-Rows", "X-Export-Last-Key", "Retry-After"])
+    admission = AdmissionControl(app)
+    TimeBudgets(app)
+    shards = ShardRouter(app, app.config["SHARD_URIS"])
+    archive = Archive(app, app.config["ARCHIVE_URI"])
     db.init_app(app)
+    init_cache(app)
+    init_treatments()
+    init_rollups()
+    init_changefeed()
+    init_sql_metrics()
+    init_time_budgets()
+    job_runner = JobRunner(app)
+    event_hub = EventHub(
+        app,
+        poll_interval=app.config["EVENT_POLL_INTERVAL"],
+        max_subscribers=app.config["EVENT_STREAM_LIMIT"],
+    )
 
 
     @app.get("/")
@@ -33,24 +127,100 @@ def create_app():
     def create_tables():
         with app.app_context():
             db.create_all()
-        return {"status": "tables created"}
+            applied = run_migrations()
+            shards.create_all()
+            archive.create_all()
+        return {"status": "tables created", "migrations_applied": applied, "shards": shards.count}
+
+    @app.cli.command("migrate")
+    def migrate_command():
+        db.create_all()
+        for name in run_migrations():
+            print(f"applied {name}")
+        shards.create_all()
+        archive.create_all()
+
+    @app.cli.command("shard-migrate")
+    @click.option("--batch-size", type=int, default=None)
+    def shard_migrate_command(batch_size):
+        # Run once after setting HMS_SHARD_URIS on a database that already has
+        # patients: until then they stay on the primary, where nothing reads them.
+        if not shards.enabled:
+            raise click.ClickException("HMS_SHARD_URIS is not set")
+        shards.create_all()
+        for table, count in shards.migrate_primary(batch_size).items():
+            print(f"{table}: moved {count} rows to the shards")
+
+    @app.cli.command("archive")
+    @click.option("--days", type=int, default=None, help="Retention window after discharge.")
+    @click.option("--batch-size", type=int, default=None)
+    def archive_command(days, batch_size):
+        days = app.config["ARCHIVE_RETENTION_DAYS"] if days is None else days
+        cutoff = date.today() - timedelta(days=days)
+        archive.create_all()
+        for shard, session in enumerate(shards.sessions()):
+            moved = archive.run(session, cutoff, batch_size)
+            print(f"shard {shard}: archived {moved} patients discharged before {cutoff}")
+
+    @app.cli.command("export")
+    @click.argument("table", type=click.Choice(sorted(EXPORT_MODELS), case_sensitive=False))
+    @click.argument("path", type=click.Path(dir_okay=False, writable=True))
+    @click.option("--format", "fmt", type=click.Choice(sorted(FORMATS)), default="parquet")
+    @click.option("--after", default=None, help="Export keys greater than these, one per shard.")
+    @click.option("--until", type=int, default=None, help="Export keys up to and including this.")
+    def export_command(table, path, fmt, after, until):
+        sessions = shards.sessions()
+        try:
+            after = parse_after(after, len(sessions))
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--after")
+        try:
+            with open(path, "wb") as sink:
+                rows, last_keys = write_export(
+                    sink, fmt, EXPORT_MODELS[table.upper()], sessions, after, until
+                )
+        except ExportUnavailable as e:
+            raise click.ClickException(str(e))
+        next_after = ",".join("" if key is None else str(key) for key in last_keys)
+        print(f"wrote {rows} rows to {path}; next --after: {next_after}")
 
     @app.get("/api/health")
     def health():
         return {"status": "ok"}
 
+    @app.get("/api/metrics")
+    def get_metrics():
+        return {
+            "counters": metrics.snapshot(),
+            "sql_compiled_cache_hit_ratio": statement_cache_hit_ratio(),
+            "warmup_seconds": app.config.get("WARMUP_SECONDS"),
+            "admission": admission.stats()
+        }
+
+    @app.get("/api/cache/stats")
+    def cache_stats():
+        stats = cache.analytics_cache.stats()
+        if cache.shared_cache is not None:
+            stats["shared"] = cache.shared_cache.stats()
+        return stats
+
 
     @app.get("/api/patients")
     def list_patients():
-        rows = Patient.query.all()
-        return jsonify([
+        parts = shards.fan_out(lambda s: [
             {c.name: getattr(p, c.name) for c in p.__table__.columns}
-            for p in rows
+            for p in s.query(Patient).all()
         ])
+        return jsonify(sorted(chain.from_iterable(parts), key=lambda p: p["Patient_ID"]))
 
     @app.get("/api/patients/<int:pid>")
     def get_patient(pid):
-        p = Patient.query.get_or_404(pid)
+        p = shards.session_for(pid).get(Patient, pid)
+        if p is None:
+            archived = archive.patient(pid)
+            if archived is None:
+                abort(404)
+            return archived
         return {c.name: getattr(p, c.name) for c in p.__table__.columns}
 
     @app.post("/api/patients")
@@ -72,13 +242,18 @@ def create_app():
                 if d.get("DischargeDate") else None,
             Room_ID=d.get("Room_ID")
         )
-        db.session.add(p)
-        db.session.commit()
+        try:
+            shard = shards.place(d.get("Hospital_ID"))
+        except (TypeError, ValueError):
+            return {"error": "Hospital_ID must be an integer"}, 400
+        session = shards.session(shard)
+        session.add(p)
+        session.commit()
         return {"created": p.Patient_ID}, 201
 
     @app.put("/api/patients/<int:pid>")
     def update_patient(pid):
-        p = Patient.query.get_or_404(pid)
+        p = shards.get_or_404(Patient, pid)
         d = request.json or {}
 
         for field in [
@@ -97,20 +272,23 @@ def create_app():
         if "DischargeDate" in d:
             p.DischargeDate = datetime.fromisoformat(d["DischargeDate"]).date() if d["DischargeDate"] else None
 
-        db.session.commit()
+        shards.session_for(pid).commit()
         return {c.name: getattr(p, c.name) for c in p.__table__.columns}
 
     @app.delete("/api/patients/<int:pid>")
     def delete_patient(pid):
-        p = Patient.query.get_or_404(pid)
-        db.session.delete(p)
-        db.session.commit()
+        session = shards.session_for(pid)
+        p = shards.get_or_404(Patient, pid)
+        session.delete(p)
+        session.commit()
         return {"deleted": pid}
 
 
     @app.get("/api/employees")
     def list_employees():
-        employees = Employee.query.all()
+        # Load every subtype's columns in the same query instead of one
+        # extra lookup per employee.
+        employees = db.session.scalars(select(with_polymorphic(Employee, "*"))).all()
         output = []
 
         for e in employees:
@@ -122,17 +300,11 @@ def create_app():
             }
 
             if e.Type == "Doctor":
-                doc = Doctor.query.get(e.Employee_ID)
-                data["Specialty"] = doc.Specialty
-                data["Contact"] = doc.Contact
+                data["Specialty"] = e.Specialty
+                data["Contact"] = e.Contact
 
-            elif e.Type == "Nurse":
-                nurse = Nurse.query.get(e.Employee_ID)
-                data["Contact"] = nurse.Contact
-
-            elif e.Type == "Receptionist":
-                rec = Receptionist.query.get(e.Employee_ID)
-                data["Contact"] = rec.Contact
+            elif e.Type in ("Nurse", "Receptionist"):
+                data["Contact"] = e.Contact
 
             output.append(data)
 
@@ -168,7 +340,7 @@ def create_app():
 
     @app.get("/api/doctors/<int:did>")
     def get_doctor(did):
-        d = Doctor.query.get_or_404(did)
+        d = db.get_or_404(Doctor, did)
         return {
             "Doctor_ID": d.Doctor_ID,
             "Name": d.Name,
@@ -179,7 +351,7 @@ def create_app():
 
     @app.put("/api/doctors/<int:did>")
     def update_doctor(did):
-        d_obj = Doctor.query.get_or_404(did)
+        d_obj = db.get_or_404(Doctor, did)
         data = request.json or {}
 
         for field in ["Name", "Salary", "Specialty", "Contact"]:
@@ -198,7 +370,7 @@ def create_app():
 
     @app.delete("/api/doctors/<int:did>")
     def delete_doctor(did):
-        d = Doctor.query.get_or_404(did)
+        d = db.get_or_404(Doctor, did)
         db.session.delete(d)
         db.session.commit()
         return {"deleted": did}
@@ -231,7 +403,7 @@ def create_app():
 
     @app.get("/api/nurses/<int:nid>")
     def get_nurse(nid):
-        n = Nurse.query.get_or_404(nid)
+        n = db.get_or_404(Nurse, nid)
         return {
             "Nurse_ID": n.Nurse_ID,
             "Name": n.Name,
@@ -241,7 +413,7 @@ def create_app():
 
     @app.put("/api/nurses/<int:nid>")
     def update_nurse(nid):
-        n_obj = Nurse.query.get_or_404(nid)
+        n_obj = db.get_or_404(Nurse, nid)
         data = request.json or {}
 
         for field in ["Name", "Salary", "Contact"]:
@@ -259,7 +431,7 @@ def create_app():
 
     @app.delete("/api/nurses/<int:nid>")
     def delete_nurse(nid):
-        n = Nurse.query.get_or_404(nid)
+        n = db.get_or_404(Nurse, nid)
         db.session.delete(n)
         db.session.commit()
         return {"deleted": nid}
@@ -292,7 +464,7 @@ def create_app():
 
     @app.get("/api/receptionists/<int:rid>")
     def get_receptionist(rid):
-        r = Receptionist.query.get_or_404(rid)
+        r = db.get_or_404(Receptionist, rid)
         return {
             "Receptionist_ID": r.Receptionist_ID,
             "Name": r.Name,
@@ -302,7 +474,7 @@ def create_app():
 
     @app.put("/api/receptionists/<int:rid>")
     def update_receptionist(rid):
-        r_obj = Receptionist.query.get_or_404(rid)
+        r_obj = db.get_or_404(Receptionist, rid)
         data = request.json or {}
 
         for field in ["Name", "Salary", "Contact"]:
@@ -320,7 +492,7 @@ def create_app():
 
     @app.delete("/api/receptionists/<int:rid>")
     def delete_receptionist(rid):
-        r = Receptionist.query.get_or_404(rid)
+        r = db.get_or_404(Receptionist, rid)
         db.session.delete(r)
         db.session.commit()
         return {"deleted": rid}
@@ -347,6 +519,91 @@ def create_app():
             for r in rows
         ])
 
+    @app.post("/api/patients/<int:pid>/assign_room")
+    def assign_room(pid):
+        room_type = request.args.get("type")
+        if not room_type:
+            return {"error": "type is required"}, 400
+
+        # Rooms stay on the primary database; the patient may live on a shard.
+        patients = shards.session_for(pid)
+        p = shards.get_or_404(Patient, pid)
+        previous_room = p.Room_ID
+
+        # The candidate is picked with a locking read that skips rows other
+        # callers hold: unlike a plain SELECT under REPEATABLE READ it sees
+        # their committed claims, so concurrent callers each get a different
+        # free room. The conditional UPDATE still guards the claim where
+        # FOR UPDATE is a no-op (SQLite).
+        room_id = None
+        for _ in range(3):
+            rid = db.session.scalar(
+                select(Room.Room_ID)
+                .where(Room.Room_Type == room_type, Room.Status == "Available")
+                .order_by(Room.Room_ID)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            if rid is None:
+                break
+            claimed = db.session.execute(
+                update(Room)
+                .where(Room.Room_ID == rid, Room.Status == "Available")
+                .values(Status="Occupied")
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if claimed:
+                room_id = rid
+                break
+
+        if room_id is None:
+            db.session.rollback()
+            return {"error": f"No available {room_type} room"}, 409
+
+        # Move the patient only if nobody reassigned them in the meantime.
+        moved = patients.execute(
+            update(Patient)
+            .where(
+                Patient.Patient_ID == pid,
+                Patient.Room_ID == previous_room
+                if previous_room is not None else Patient.Room_ID.is_(None),
+            )
+            .values(Room_ID=room_id, Admitted=True)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not moved:
+            patients.rollback()
+            db.session.rollback()
+            return {"error": "Patient was reassigned concurrently, retry"}, 409
+
+        record_changes(patients, [
+            change_row("PATIENT", pid, "update", {"Room_ID": room_id, "Admitted": True})
+        ])
+        changes = [change_row("ROOM", room_id, "update", {"Status": "Occupied"})]
+        if previous_room is not None:
+            db.session.execute(
+                update(Room)
+                .where(Room.Room_ID == previous_room)
+                .values(Status="Available")
+                .execution_options(synchronize_session=False)
+            )
+            changes.append(change_row("ROOM", previous_room, "update", {"Status": "Available"}))
+        record_changes(db.session, changes)
+
+        # With shards these are two transactions: the room claim lands first,
+        # so a failure in between leaves a room marked occupied rather than
+        # two patients in one room.
+        db.session.commit()
+        patients.commit()
+        room = db.session.get(Room, room_id)
+        return {
+            "Patient_ID": pid,
+            "Room_ID": room_id,
+            "Room_Number": room.Room_Number,
+            "Room_Type": room.Room_Type,
+            "Previous_Room_ID": previous_room
+        }
+
 
     @app.post("/api/medications")
     def create_medication():
@@ -356,45 +613,86 @@ def create_app():
             Dosage=d.get("Dosage"),
             Patient_ID=d.get("Patient_ID")
         )
-        db.session.add(m)
-        db.session.commit()
+        session = shards.session_for(m.Patient_ID)
+        session.add(m)
+        session.commit()
         return {"created": m.Medication_ID}, 201
 
+    def _patient_ids_arg():
+        raw = request.args.get("patient_ids", "")
+        try:
+            return sorted({int(x) for x in raw.split(",") if x.strip()})
+        except ValueError:
+            return None
+
+    def _rows_by_patient(model, ids):
+        # One indexed IN (...) query per chunk keeps the bind-parameter count
+        # under the driver limits for very long id lists.
+        grouped = {pid: [] for pid in ids}
+        for shard, shard_ids in shards.group(ids).items():
+            session = shards.session(shard)
+            for i in range(0, len(shard_ids), PATIENT_ID_CHUNK):
+                rows = (
+                    session.query(model)
+                    .filter(model.Patient_ID.in_(shard_ids[i:i + PATIENT_ID_CHUNK]))
+                    .order_by(model.Patient_ID)
+                    .all()
+                )
+                for r in rows:
+                    grouped[r.Patient_ID].append({c.name: getattr(r, c.name) for c in r.__table__.columns})
+        return jsonify({str(pid): rows for pid, rows in grouped.items()})
+
+    def _batch_lookup(model):
+        ids = _patient_ids_arg()
+        if not ids:
+            return {"error": "patient_ids must be a comma-separated list of ids"}, 400
+        return _rows_by_patient(model, ids)
+
     @app.get("/api/medications")
     def list_medications():
-        rows = Medication.query.all()
-        return jsonify([
+        if "patient_ids" in request.args:
+            return _batch_lookup(Medication)
+        parts = shards.fan_out(lambda s: [
             {c.name: getattr(m, c.name) for c in m.__table__.columns}
-            for m in rows
+            for m in s.query(Medication).all()
         ])
+        return jsonify(list(chain.from_iterable(parts)))
 
 
     @app.get("/api/bills")
     def list_bills():
-        rows = Bill.query.all()
-        return jsonify([
+        if "patient_ids" in request.args:
+            return _batch_lookup(Bill)
+        parts = shards.fan_out(lambda s: [
             {c.name: getattr(r, c.name) for c in r.__table__.columns}
-            for r in rows
+            for r in s.query(Bill).all()
         ])
+        return jsonify(list(chain.from_iterable(parts)))
     @app.post("/api/bills")
     def create_bill():
         d = request.json or {}
+        session = shards.session_for(d.get("Patient_ID"))
 
         b = Bill(
             Patient_ID=d.get("Patient_ID"),
             Treatment=d.get("Treatment"),
+            Treatment_ID=treatment_catalog.resolve(session, d.get("Treatment")),
             Total_Amount=d.get("Total_Amount")
         )
 
-        db.session.add(b)
-        db.session.commit()
+        session.add(b)
+        session.commit()
 
         return {"created": b.Bill_ID}, 201
 
 
     @app.get("/api/patients/<int:pid>/bills")
     def bills_for_patient(pid):
-        rows = Bill.query.filter_by(Patient_ID=pid).all()
+        rows = shards.session_for(pid).scalars(
+            lambda_stmt(lambda: select(Bill).where(Bill.Patient_ID == pid))
+        ).all()
+        if not rows:
+            return jsonify(archive.rows(Bill, pid))
         return jsonify([
             {c.name: getattr(b, c.name) for c in b.__table__.columns}
             for b in rows
@@ -409,42 +707,167 @@ def create_app():
             VisitDate=datetime.fromisoformat(d["VisitDate"]).date(),
             Notes=d.get("Notes")
         )
-        db.session.add(v)
-        db.session.commit()
+        session = shards.session_for(v.Patient_ID)
+        session.add(v)
+        session.commit()
         return {"created": v.Visit_ID}, 201
 
+    @app.get("/api/visits")
+    def visits_for_patients():
+        return _batch_lookup(Visit)
+
+    def _visit_page(execute, table, pid, after, limit, notes):
+        # Newest first along (Patient_ID, VisitDate, Visit_ID). The row-value
+        # comparison lets the index seek straight to the cursor; undated
+        # visits come after all dated ones and are only read on the last page.
+        columns = [table.c[c.name] for c in Visit.__table__.columns if notes or c.name != "Notes"]
+        base = select(*columns).where(table.c.Patient_ID == pid)
+        rows = []
+        if after is None or after[0] is not None:
+            q = base.where(table.c.VisitDate.isnot(None))
+            if after is not None:
+                q = q.where(tuple_(table.c.VisitDate, table.c.Visit_ID) < tuple_(*after))
+            rows = execute(
+                q.order_by(table.c.VisitDate.desc(), table.c.Visit_ID.desc()).limit(limit + 1)
+            ).all()
+        if len(rows) <= limit:
+            q = base.where(table.c.VisitDate.is_(None))
+            if after is not None and after[0] is None:
+                q = q.where(table.c.Visit_ID < after[1])
+            rows += execute(q.order_by(table.c.Visit_ID.desc()).limit(limit + 1 - len(rows))).all()
+        return [dict(r._mapping) for r in rows]
+
     @app.get("/api/visits/<int:pid>")
     def get_visits(pid):
-        rows = Visit.query.filter_by(Patient_ID=pid).all()
-        return jsonify([
-            {c.name: getattr(v, c.name) for c in v.__table__.columns}
-            for v in rows
-        ])
+        # Pages of ?limit= visits; X-Next-Cursor carries the last row's
+        # "VisitDate:Visit_ID" to pass back as ?cursor= for the next page.
+        limit = min(max(request.args.get("limit", VISIT_PAGE_SIZE, type=int), 1), 500)
+        notes = "notes" in request.args.get("include", "").split(",")
+        after = None
+        if request.args.get("cursor"):
+            day, _, vid = request.args["cursor"].rpartition(":")
+            try:
+                after = (datetime.fromisoformat(day).date() if day else None, int(vid))
+            except ValueError:
+                return {"error": "cursor must be VisitDate:Visit_ID as returned in X-Next-Cursor"}, 400
+
+        rows = _visit_page(shards.session_for(pid).execute, Visit.__table__, pid, after, limit, notes)
+        if not rows:
+            with archive.engine.connect() as conn:
+                rows = _visit_page(conn.execute, archive_tables[Visit], pid, after, limit, notes)
+
+        response = jsonify(rows[:limit])
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            day = last["VisitDate"].isoformat() if last["VisitDate"] else ""
+            response.headers["X-Next-Cursor"] = f"{day}:{last['Visit_ID']}"
+        return response
 
     @app.post("/api/recommendations")
     def create_recommendation():
         d = request.json or {}
         r = Recommendation(Patient_ID=d["Patient_ID"], Text=d["Text"])
-        db.session.add(r)
-        db.session.commit()
+        session = shards.session_for(r.Patient_ID)
+        session.add(r)
+        session.commit()
         return {"created": r.Rec_ID}, 201
 
+    @app.get("/api/recommendations")
+    def recommendations_for_patients():
+        return _batch_lookup(Recommendation)
+
     @app.get("/api/recommendations/<int:pid>")
     def get_recommendations(pid):
-        rows = Recommendation.query.filter_by(Patient_ID=pid).all()
+        rows = shards.session_for(pid).scalars(
+            lambda_stmt(lambda: select(Recommendation).where(Recommendation.Patient_ID == pid))
+        ).all()
+        if not rows:
+            return jsonify(archive.rows(Recommendation, pid))
         return jsonify([
             {c.name: getattr(x, c.name) for c in x.__table__.columns}
             for x in rows
         ])
 
+    def _date_arg(name):
+        # None when absent; ValueError when not an ISO date.
+        raw = request.args.get(name)
+        return datetime.fromisoformat(raw).date() if raw else None
+
+    def _date_range():
+        # Returns (start, end, error) for the from/to analytics range: the
+        # 90 days up to to (default today), at most ten years long.
+        try:
+            end = _date_arg("to") or date.today()
+            start = _date_arg("from") or end - timedelta(days=89)
+        except ValueError:
+            return None, None, DATE_ARGS_ERROR
+        if start > end:
+            return None, None, {"error": "from must not be after to"}
+        if (end - start).days > 3660:
+            return None, None, {"error": "Range is limited to 10 years"}
+        return start, end, None
+
     @app.get("/api/schedule/<int:eid>")
     def get_schedule(eid):
-        rows = Schedule.query.filter_by(Employee_ID=eid).all()
+        try:
+            start, end = _date_arg("from"), _date_arg("to")
+        except ValueError:
+            return DATE_ARGS_ERROR, 400
+        q = Schedule.query.filter_by(Employee_ID=eid)
+        if start:
+            q = q.filter(Schedule.WorkDate >= start)
+        if end:
+            q = q.filter(Schedule.WorkDate <= end)
+        rows = q.order_by(Schedule.WorkDate).all()
         return jsonify([
             {c.name: getattr(s, c.name) for c in s.__table__.columns}
             for s in rows
         ])
 
+    @app.get("/api/schedule")
+    def roster():
+        # Defaults to the current Monday-Sunday week.
+        today = date.today()
+        try:
+            start = _date_arg("from") or today - timedelta(days=today.weekday())
+            end = _date_arg("to") or start + timedelta(days=6)
+        except ValueError:
+            return DATE_ARGS_ERROR, 400
+
+        doctors = Doctor.__table__
+        nurses = Nurse.__table__
+        receptionists = Receptionist.__table__
+
+        q = (
+            db.session.query(
+                Schedule.Schedule_ID,
+                Schedule.Employee_ID,
+                Schedule.WorkDate,
+                Schedule.Shift,
+                Employee.Name,
+                Employee.Type,
+                doctors.c.Specialty,
+                func.coalesce(
+                    doctors.c.Contact, nurses.c.Contact, receptionists.c.Contact
+                ).label("Contact")
+            )
+            .select_from(Schedule)
+            .join(Employee, Employee.Employee_ID == Schedule.Employee_ID)
+            .outerjoin(doctors, doctors.c.Doctor_ID == Employee.Employee_ID)
+            .outerjoin(nurses, nurses.c.Nurse_ID == Employee.Employee_ID)
+            .outerjoin(receptionists, receptionists.c.Receptionist_ID == Employee.Employee_ID)
+            .filter(Schedule.WorkDate >= start, Schedule.WorkDate <= end)
+        )
+        if request.args.get("type"):
+            q = q.filter(Employee.Type == request.args["type"])
+
+        rows = q.order_by(Schedule.WorkDate, Schedule.Shift, Schedule.Employee_ID).all()
+        return jsonify({
+            "from": str(start),
+            "to": str(end),
+            "shifts": [dict(r._mapping) for r in rows]
+        })
+
     @app.get("/api/resources")
     def get_resources():
         rows = Resource.query.all()
@@ -467,59 +890,221 @@ def create_app():
 
         return {"created": r.Resource_ID}, 201
 
-
-
-    @app.get("/api/analytics/patient_flow")
-    def patient_flow():
-        rows = (
-            db.session.query(Patient.AdmissionDate, func.count(Patient.Patient_ID))
+    def _stock_items(d):
+        # [{"Resource_ID": id, "quantity": n}, ...] merged per resource and
+        # sorted by id, so concurrent batches always lock rows in one order.
+        items = d.get("items") if isinstance(d, dict) else None
+        if not isinstance(items, list):
+            return None
+        totals = {}
+        for item in items:
+            if not isinstance(item, dict):
+                return None
+            rid, n = item.get("Resource_ID"), item.get("quantity", 1)
+            if (
+                not isinstance(rid, int) or isinstance(rid, bool)
+                or not isinstance(n, int) or isinstance(n, bool) or n <= 0
+            ):
+                return None
+            totals[rid] = totals.get(rid, 0) + n
+        return sorted(totals.items())
+
+    def _adjust_stock(items, op):
+        # Returns (quantities, error_response). Each row moves with a
+        # conditional in-database update, so no read-modify-write cycle can
+        # lose a concurrent change; a reservation never drives stock below 0.
+        for attempt in range(3):
+            try:
+                for rid, n in items:
+                    if op == "reserve":
+                        stmt = (
+                            update(Resource)
+                            .where(Resource.Resource_ID == rid, Resource.Quantity >= n)
+                            .values(Quantity=Resource.Quantity - n)
+                        )
+                    else:
+                        stmt = (
+                            update(Resource)
+                            .where(Resource.Resource_ID == rid)
+                            .values(Quantity=func.coalesce(Resource.Quantity, 0) + n)
+                        )
+                    if db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount:
+                        continue
+
+                    available = db.session.scalar(
+                        select(Resource.Quantity).where(Resource.Resource_ID == rid)
+                    )
+                    exists = db.session.scalar(
+                        select(func.count()).select_from(Resource).where(Resource.Resource_ID == rid)
+                    )
+                    db.session.rollback()
+                    if not exists:
+                        return None, ({"error": f"Resource {rid} not found"}, 404)
+                    metrics.incr(f"resources.{op}.insufficient")
+                    return None, ({
+                        "error": "Insufficient stock",
+                        "Resource_ID": rid,
+                        "requested": n,
+                        "available": available
+                    }, 409)
+
+                quantities = dict(
+                    db.session.query(Resource.Resource_ID, Resource.Quantity)
+                    .filter(Resource.Resource_ID.in_([rid for rid, _ in items]))
+                    .all()
+                )
+                record_changes(db.session, [
+                    change_row("RESOURCE", rid, "update", {"Quantity": q})
+                    for rid, q in quantities.items()
+                ])
+                db.session.commit()
+                metrics.incr(f"resources.{op}.succeeded")
+                metrics.incr(f"resources.{op}.units", sum(n for _, n in items))
+                return quantities, None
+            except OperationalError as e:
+                # Past the request's time budget: let TimeBudgets answer 504.
+                if budget_exceeded(e):
+                    raise
+                # Lock timeout or deadlock against another writer.
+                db.session.rollback()
+                metrics.incr(f"resources.{op}.conflicts")
+        metrics.incr(f"resources.{op}.failed")
+        return None, ({"error": "Stock is busy, retry"}, 503)
+
+    @app.post("/api/resources/<int:rid>/reserve")
+    @app.post("/api/resources/<int:rid>/release")
+    def adjust_resource(rid):
+        op = request.path.rsplit("/", 1)[-1]
+        d = request.json or {}
+        if not isinstance(d, dict):
+            return {"error": "Body must be a JSON object"}, 400
+        items = _stock_items({"items": [{**d, "Resource_ID": rid}]})
+        if not items:
+            return {"error": "quantity must be a positive integer"}, 400
+        metrics.incr(f"resources.{op}.attempts")
+        quantities, error = _adjust_stock(items, op)
+        if error:
+            return error
+        return {"Resource_ID": rid, "Quantity": quantities[rid]}
+
+    @app.post("/api/resources/reserve")
+    @app.post("/api/resources/release")
+    def adjust_resources():
+        op = request.path.rsplit("/", 1)[-1]
+        items = _stock_items(request.json or {})
+        if not items:
+            return {"error": "items must list Resource_ID and a positive quantity"}, 400
+        metrics.incr(f"resources.{op}.attempts")
+        quantities, error = _adjust_stock(items, op)
+        if error:
+            return error
+        return {"resources": [{"Resource_ID": rid, "Quantity": q} for rid, q in quantities.items()]}
+
+    @app.get("/api/resources/stats")
+    def resource_stats():
+        return metrics.snapshot("resources.")
+
+
+
+    # Analytics over patient data run per shard (once, when unsharded) and
+    # merge the partial aggregates here, together with the archive's.
+    def _admissions_by_day():
+        totals = defaultdict(int)
+        for rows in shards.fan_out(lambda s: (
+            s.query(Patient.AdmissionDate, func.count(Patient.Patient_ID))
             .filter(Patient.AdmissionDate.isnot(None))
             .group_by(Patient.AdmissionDate)
-            .order_by(Patient.AdmissionDate)
             .all()
-        )
+        )):
+            for day, count in rows:
+                totals[day] += count
+        for day, count in archive.admissions_by_day():
+            totals[day] += count
+        return sorted(totals.items())
+
+    def _merge_by_treatment(parts):
+        # Catalog ids are per database, so partials meet on the normalized name.
+        merged = {}
+        for rows in parts:
+            for key, name, count, total in rows:
+                entry = merged.setdefault(key, [name, 0, 0])
+                entry[1] += count
+                entry[2] += total
+        return merged.values()
+
+    def _treatment_costs(limit=None):
+        if not shards.enabled:
+            # One database: rank and cut in SQL.
+            q = (
+                db.session.query(Treatment.Name, avg_treatment_cost)
+                .join(Treatment, Treatment.Treatment_ID == TreatmentStats.Treatment_ID)
+                .filter(TreatmentStats.Bill_Count > 0)
+                .order_by(avg_treatment_cost.desc())
+            )
+            if limit is not None:
+                q = q.limit(limit)
+            return [(name, float(cost)) for name, cost in q.all()]
+
+        parts = shards.fan_out(lambda s: (
+            s.query(
+                Treatment.Normalized_Name, Treatment.Name,
+                TreatmentStats.Bill_Count, TreatmentStats.Total_Sum
+            )
+            .join(Treatment, Treatment.Treatment_ID == TreatmentStats.Treatment_ID)
+            .filter(TreatmentStats.Bill_Count > 0)
+            .all()
+        ))
+        costs = [(name, float(total) / count) for name, count, total in _merge_by_treatment(parts)]
+        return sorted(costs, key=lambda c: c[1], reverse=True)[:limit]
+
+    @app.get("/api/analytics/patient_flow")
+    @cached("PATIENT")
+    def patient_flow():
+        rows = _admissions_by_day()
 
         if not rows:
             return {"error": "No admission data"}
 
         history = [{"date": str(d), "count": c} for d, c in rows]
 
-        counts = [c for _, c in rows]
-        window = min(5, len(counts))
-        moving_avg = sum(counts[-window:]) / window
+        horizon = min(max(request.args.get("horizon", 7, type=int), 1), 90)
+        alpha = request.args.get("alpha", 0.3, type=float)
+        if not math.isfinite(alpha) or not 0 < alpha <= 1:
+            return {"error": "alpha must be a number in (0, 1]"}, 400
+        forecasts = forecast(
+            rows,
+            horizon=horizon,
+            window=request.args.get("window", 5, type=int),
+            alpha=alpha
+        )
 
-        return {"history": history, "predicted_next_day": round(moving_avg)}
+        return {
+            "history": history,
+            "predicted_next_day": round(forecasts["moving_average"][0]["predicted"]),
+            "forecasts": forecasts
+        }
 
     @app.get("/api/analytics/resource_optimization")
+    @cached("BILL")
     def resource_optimization():
-        rows = (
-            db.session.query(Bill.Treatment, func.avg(Bill.Total_Amount))
-            .group_by(Bill.Treatment)
-            .order_by(func.avg(Bill.Total_Amount).desc())
-            .all()
-        )
+        rows = _treatment_costs(limit=5)
 
         return {
             "most_expensive_procedures": [
-                {"treatment": t, "avg_cost": float(c)}
-                for t, c in rows[:5]
+                {"treatment": t, "avg_cost": c}
+                for t, c in rows
             ]
         }
 
 
     @app.get("/api/analytics/room_shortage_forecast")
+    @cached("ROOM", "PATIENT")
     def room_shortage_forecast():
         total_rooms = Room.query.count()
         occupied_rooms = Room.query.filter_by(Status="Occupied").count()
         available_rooms = total_rooms - occupied_rooms
 
-        admission_rows = (
-            db.session.query(Patient.AdmissionDate, func.count(Patient.Patient_ID))
-            .filter(Patient.AdmissionDate.isnot(None))
-            .group_by(Patient.AdmissionDate)
-            .order_by(Patient.AdmissionDate)
-            .all()
-        )
+        admission_rows = _admissions_by_day()
 
         if not admission_rows:
             return {"error": "Not enough admission data to forecast."}
@@ -528,18 +1113,11 @@ def create_app():
         window = min(5, len(counts))
         predicted_next_day = sum(counts[-window:]) / window
 
-        los_rows = (
-            db.session.query(
-                func.avg(
-                    func.julianday(Patient.DischargeDate)
-                    - func.julianday(Patient.AdmissionDate)
-                )
-            )
-            .filter(Patient.DischargeDate.isnot(None))
-            .all()
-        )
-
-        avg_los = los_rows[0][0] if los_rows and los_rows[0][0] else 3
+        stays = shards.fan_out(lambda s: (
+            s.query(func.sum(Patient.Length_Of_Stay), func.count(Patient.Length_Of_Stay)).one()
+        )) + [archive.length_of_stay()]
+        total_days = sum(days or 0 for days, _ in stays)
+        avg_los = float(total_days) / sum(n for _, n in stays) if total_days else 3
 
         if predicted_next_day == 0:
             projected_shortage_days = None
@@ -566,33 +1144,30 @@ def create_app():
         }
 
     @app.get("/api/analytics/resource_optimization_v2")
+    @cached("BILL", "PATIENT", "RESOURCE")
     def resource_optimization_v2():
 
         # 1. AVERAGE COST PER PROCEDURE
-        procedure_costs = (
-            db.session.query(
-                Bill.Treatment,
-                func.avg(Bill.Total_Amount).label("avg_cost")
-            )
-            .group_by(Bill.Treatment)
-            .order_by(func.avg(Bill.Total_Amount).desc())
-            .all()
-        )
+        procedure_costs = _treatment_costs()
 
         # 2. AVERAGE LENGTH OF STAY PER PROCEDURE
-        los_by_treatment = (
-            db.session.query(
-                Bill.Treatment,
-                func.avg(
-                    func.julianday(Patient.DischargeDate)
-                    - func.julianday(Patient.AdmissionDate)
-                ).label("avg_los")
+        los_parts = shards.fan_out(lambda s: (
+            s.query(
+                Treatment.Normalized_Name,
+                Treatment.Name,
+                func.count(Patient.Length_Of_Stay),
+                func.sum(Patient.Length_Of_Stay)
             )
+            .select_from(Bill)
+            .join(Treatment, Treatment.Treatment_ID == Bill.Treatment_ID)
             .join(Patient, Patient.Patient_ID == Bill.Patient_ID)
-            .filter(Patient.DischargeDate.isnot(None))
-            .group_by(Bill.Treatment)
+            .filter(Patient.Length_Of_Stay.isnot(None))
+            .group_by(Bill.Treatment_ID, Treatment.Normalized_Name, Treatment.Name)
             .all()
-        )
+        )) + [archive.length_of_stay_by_treatment()]
+        los_by_treatment = [
+            (name, days / count) for name, count, days in _merge_by_treatment(los_parts)
+        ]
 
         # 3. EQUIPMENT USAGE SUMMARY 
         equipment_usage = (
@@ -607,16 +1182,416 @@ def create_app():
 
         return {
             "procedure_costs": [
-                {"treatment": t, "avg_cost": float(c)} for t, c in procedure_costs
+                {"treatment": t, "avg_cost": c} for t, c in procedure_costs
             ],
             "procedure_length_of_stay": [
-                {"treatment": t, "avg_los_days": round(los, 2)} for t, los in los_by_treatment
+                {"treatment": t, "avg_los_days": round(float(los), 2)} for t, los in los_by_treatment
             ],
             "equipment_usage": [
                 {"equipment_name": name, "usage_count": count} for name, count in equipment_usage
             ]
         }
 
+    @app.get("/api/analytics/census")
+    @cached("PATIENT", "ROOM")
+    def census():
+        start, end, error = _date_range()
+        if error:
+            return error, 400
+
+        by_room_type = request.args.get("by") == "room_type"
+
+        # One range scan per shard, and one over the archive: every stay
+        # that overlaps [start, end].
+        parts = shards.fan_out(lambda s: (
+            s.query(Patient.AdmissionDate, Patient.DischargeDate, Patient.Room_ID)
+            .filter(
+                Patient.AdmissionDate.isnot(None),
+                Patient.AdmissionDate <= end,
+                (Patient.DischargeDate.is_(None)) | (Patient.DischargeDate > start)
+            )
+            .all()
+        ))
+        rows = list(chain.from_iterable(parts)) + archive.stays(start, end)
+        if by_room_type:
+            # Patients only record their current room, so stays are split
+            # by the type of that room. Rooms live on the primary database.
+            room_types = dict(db.session.query(Room.Room_ID, Room.Room_Type).all())
+            rows = [(adm, dis, room_types.get(rid)) for adm, dis, rid in rows]
+
+        dates = [str(start + timedelta(days=i)) for i in range((end - start).days + 1)]
+        stays = [(r[0], r[1]) for r in rows]
+        totals = daily_census(stays, start, end)
+        days = [{"date": d, "census": int(n)} for d, n in zip(dates, totals)]
+
+        if by_room_type:
+            # Every room type is reported on every day, zero when empty.
+            groups = sorted(
+                {t or "Unassigned" for t in room_types.values()}
+                | {r[2] or "Unassigned" for r in rows}
+            )
+            code_of = {t: j for j, t in enumerate(groups)}
+            codes = [code_of[r[2] or "Unassigned"] for r in rows]
+            split = daily_census(stays, start, end, groups=codes)
+            for i, day in enumerate(days):
+                day["by_room_type"] = {
+                    t: int(split[j][i]) if j < len(split) else 0 for j, t in enumerate(groups)
+                }
+
+        return {"from": str(start), "to": str(end), "days": days}
+
+    @app.get("/api/analytics/payroll")
+    @cached("EMPLOYEE", "DOCTOR")
+    def payroll():
+        employees = Employee.__table__
+        doctors = Doctor.__table__
+
+        # Every employee once per Type, doctors once more per Specialty, so a
+        # single statement ranks and aggregates both breakdowns.
+        rows = union_all(
+            select(
+                literal("type").label("dimension"),
+                func.coalesce(employees.c.Type, "Employee").label("grp"),
+                employees.c.Salary
+            ),
+            select(
+                literal("specialty"),
+                func.coalesce(doctors.c.Specialty, "Unspecified"),
+                employees.c.Salary
+            ).join_from(employees, doctors, doctors.c.Doctor_ID == employees.c.Employee_ID)
+        ).subquery()
+
+        group = (rows.c.dimension, rows.c.grp)
+        ranked = select(
+            *group,
+            rows.c.Salary,
+            func.row_number().over(
+                partition_by=group,
+                order_by=(case((rows.c.Salary.is_(None), 1), else_=0), rows.c.Salary)
+            ).label("rn"),
+            func.count(rows.c.Salary).over(partition_by=group).label("n")
+        ).subquery()
+
+        # Nearest-rank percentile: the smallest salary whose rank reaches p% of n.
+        percentiles = [
+            func.min(case(
+                (ranked.c.Salary.isnot(None) & (ranked.c.rn * 100 >= p * ranked.c.n), ranked.c.Salary)
+            )).label(f"p{p}")
+            for p in PAYROLL_PERCENTILES
+        ]
+        result = db.session.execute(
+            select(
+                ranked.c.dimension,
+                ranked.c.grp,
+                func.count().label("headcount"),
+                func.sum(ranked.c.Salary).label("total"),
+                func.avg(ranked.c.Salary).label("mean"),
+                *percentiles
+            )
+            .group_by(ranked.c.dimension, ranked.c.grp)
+            .order_by(ranked.c.dimension, ranked.c.grp)
+        ).all()
+
+        def money(value):
+            return round(float(value), 2) if value is not None else None
+
+        out = {"by_type": [], "by_specialty": []}
+        for r in result:
+            entry = {
+                "type" if r.dimension == "type" else "specialty": r.grp,
+                "headcount": r.headcount,
+                "total_salary": money(r.total) or 0.0,
+                "mean_salary": money(r.mean),
+                **{f"p{p}": money(getattr(r, f"p{p}")) for p in PAYROLL_PERCENTILES}
+            }
+            out["by_" + r.dimension].append(entry)
+        out["headcount"] = sum(e["headcount"] for e in out["by_type"])
+        out["total_salary"] = round(sum(e["total_salary"] for e in out["by_type"]), 2)
+        return out
+
+    @app.get("/api/analytics/nurse_workload")
+    @cached("NURSE", "EMPLOYEE", "ROOM", "PATIENT")
+    def nurse_workload():
+        max_patients = request.args.get("max_patients", app.config["NURSE_PATIENT_RATIO"], type=int)
+        nurses = Nurse.__table__
+        employees = Employee.__table__
+
+        current_patients = (
+            select(Patient.Room_ID, func.count().label("patients"))
+            .where(Patient.Room_ID.isnot(None), Patient.Discharged.isnot(True))
+            .group_by(Patient.Room_ID)
+        )
+        columns = [
+            nurses.c.Nurse_ID,
+            employees.c.Name,
+            func.count(Room.Room_ID).label("rooms"),
+            func.coalesce(func.sum(case((Room.Status == "Occupied", 1), else_=0)), 0).label("occupied_rooms"),
+        ]
+        q = (
+            select(*columns)
+            .select_from(nurses)
+            .join(employees, employees.c.Employee_ID == nurses.c.Nurse_ID)
+            .outerjoin(Room, Room.Nurse_ID == nurses.c.Nurse_ID)
+            .group_by(nurses.c.Nurse_ID, employees.c.Name)
+        )
+
+        if shards.enabled:
+            # Patients are spread over the shards: count them per room there
+            # and attribute the rooms to nurses here.
+            per_room = defaultdict(int)
+            for rows in shards.fan_out(lambda s: s.execute(current_patients).all()):
+                for room_id, n in rows:
+                    per_room[room_id] += n
+            nurse_of = dict(
+                db.session.query(Room.Room_ID, Room.Nurse_ID).filter(Room.Nurse_ID.isnot(None)).all()
+            )
+            patients = defaultdict(int)
+            for room_id, n in per_room.items():
+                if room_id in nurse_of:
+                    patients[nurse_of[room_id]] += n
+            rows = [(*r, patients[r.Nurse_ID]) for r in db.session.execute(q).all()]
+        else:
+            # One aggregate join: nurse -> rooms -> current patients per room.
+            occupancy = current_patients.subquery()
+            rows = db.session.execute(
+                q.add_columns(func.coalesce(func.sum(occupancy.c.patients), 0))
+                .outerjoin(occupancy, occupancy.c.Room_ID == Room.Room_ID)
+            ).all()
+
+        workload = sorted((
+            {
+                "Nurse_ID": nurse_id,
+                "Name": name,
+                "rooms": rooms,
+                "occupied_rooms": int(occupied),
+                "patients": int(n),
+                "over_ratio": int(n) > max_patients
+            }
+            for nurse_id, name, rooms, occupied, n in rows
+        ), key=lambda w: (-w["patients"], w["Nurse_ID"]))
+        return {
+            "max_patients_per_nurse": max_patients,
+            "nurses": workload,
+            "over_ratio": [w["Nurse_ID"] for w in workload if w["over_ratio"]]
+        }
+
+    @app.get("/api/analytics/doctor_throughput")
+    @cached("VISIT", "DOCTOR", "EMPLOYEE")
+    def doctor_throughput():
+        start, end, error = _date_range()
+        if error:
+            return error, 400
+        bucket = request.args.get("bucket", "week")
+        if bucket not in THROUGHPUT_BUCKETS:
+            return {"error": f"bucket must be one of {sorted(THROUGHPUT_BUCKETS)}"}, 400
+        bucket_of = THROUGHPUT_BUCKETS[bucket]
+
+        # Daily counts straight off the (Doctor_ID, VisitDate) index: at most
+        # doctors x days rows however many visits there are. Bucketing those
+        # is dialect-independent in Python.
+        counts = defaultdict(int)
+        for rows in shards.fan_out(lambda s: s.execute(
+            select(Visit.Doctor_ID, Visit.VisitDate, func.count())
+            .where(
+                Visit.Doctor_ID.isnot(None),
+                Visit.VisitDate >= start,
+                Visit.VisitDate <= end
+            )
+            .group_by(Visit.Doctor_ID, Visit.VisitDate)
+        ).all()):
+            for doctor_id, day, n in rows:
+                counts[doctor_id, bucket_of(day)] += n
+
+        doctors = {
+            d.Doctor_ID: d
+            for d in db.session.execute(
+                select(Doctor.Doctor_ID, Employee.Name, Doctor.Specialty)
+                .select_from(Doctor)
+                .where(Doctor.Doctor_ID.in_({doctor_id for doctor_id, _ in counts}))
+            ).all()
+        }
+
+        per_doctor = defaultdict(dict)
+        per_specialty = defaultdict(lambda: {"visits": 0, "doctors": set(), "buckets": defaultdict(int)})
+        for (doctor_id, first_day), n in counts.items():
+            per_doctor[doctor_id][first_day] = n
+            doctor = doctors.get(doctor_id)
+            specialty = (doctor.Specialty if doctor else None) or "Unspecified"
+            totals = per_specialty[specialty]
+            totals["visits"] += n
+            totals["doctors"].add(doctor_id)
+            totals["buckets"][first_day] += n
+
+        return {
+            "from": str(start),
+            "to": str(end),
+            "bucket": bucket,
+            "doctors": sorted((
+                {
+                    "Doctor_ID": doctor_id,
+                    "Name": doctors[doctor_id].Name if doctor_id in doctors else None,
+                    "Specialty": doctors[doctor_id].Specialty if doctor_id in doctors else None,
+                    "visits": sum(by_bucket.values()),
+                    "buckets": [{"start": str(d), "visits": n} for d, n in sorted(by_bucket.items())]
+                }
+                for doctor_id, by_bucket in per_doctor.items()
+            ), key=lambda d: (-d["visits"], d["Doctor_ID"])),
+            "specialties": [
+                {
+                    "specialty": specialty,
+                    "visits": totals["visits"],
+                    "doctors": len(totals["doctors"]),
+                    "buckets": [{"start": str(d), "visits": n} for d, n in sorted(totals["buckets"].items())]
+                }
+                for specialty, totals in sorted(per_specialty.items())
+            ]
+        }
+
+    @app.get("/api/export/<table>")
+    def export_table(table):
+        model = EXPORT_MODELS.get(table.upper())
+        if model is None:
+            return {"error": f"Unknown table, expected one of {sorted(EXPORT_MODELS)}"}, 400
+        fmt = request.args.get("format", "parquet")
+        if fmt not in FORMATS:
+            return {"error": f"format must be one of {sorted(FORMATS)}"}, 400
+
+        sessions = shards.sessions()
+        try:
+            after = parse_after(request.args.get("after"), len(sessions))
+        except ValueError:
+            return {
+                "error": f"after must be {len(sessions)} comma-separated keys as returned in X-Export-Last-Key"
+            }, 400
+
+        # Spooled to disk rather than memory; the file goes once it is sent.
+        sink = tempfile.TemporaryFile()
+        try:
+            rows, last_keys = write_export(
+                sink, fmt, model, sessions, after=after,
+                until=request.args.get("until", type=int)
+            )
+        except ExportUnavailable as e:
+            sink.close()
+            return {"error": str(e)}, 501
+        sink.seek(0)
+
+        mimetype, extension = FORMATS[fmt]
+        response = send_file(
+            sink, mimetype=mimetype, as_attachment=True,
+            download_name=f"{model.__tablename__.lower()}.{extension}"
+        )
+        response.headers["X-Export-Rows"] = str(rows)
+        # Highest key written per shard: pass it back as ?after= for the next
+        # incremental export.
+        response.headers["X-Export-Last-Key"] = ",".join(
+            "" if key is None else str(key) for key in last_keys
+        )
+        return response
+
+    @app.post("/api/jobs")
+    def submit_job():
+        d = request.json or {}
+        name = d.get("name")
+        params = d.get("params") or {}
+        if name not in ANALYTICS_JOBS:
+            return {"error": f"Unknown job, expected one of {sorted(ANALYTICS_JOBS)}"}, 400
+        if not isinstance(params, dict) or not all(
+            isinstance(v, (str, int, float)) for v in params.values()
+        ):
+            return {"error": "params must be an object of scalar values"}, 400
+
+        try:
+            job, created = job_runner.submit(name, params)
+        except QueueFull:
+            return {"error": "Job queue is full, retry later"}, 503, {"Retry-After": "5"}
+        return {"job_id": job.Job_ID, "status": job.Status}, 202 if created else 200
+
+    @app.get("/api/jobs/<job_id>")
+    def get_job(job_id):
+        job = db.session.get(Job, job_id)
+        if job is None or job.Expires_At <= datetime.now():
+            return {"error": "Job not found or expired"}, 404
+        return job_to_dict(job)
+
+    @app.get("/api/changes")
+    def list_changes():
+        # Sequence numbers are assigned at insert time, so a transaction that
+        # commits late can land below a seq a client has already seen; clients
+        # that need every row should re-read a small overlap behind `since`.
+        since = request.args.get("since", 0, type=int)
+        limit = min(max(request.args.get("limit", 500, type=int), 1), 5000)
+        rows = (
+            ChangeLog.query
+            .filter(ChangeLog.Seq > since)
+            .order_by(ChangeLog.Seq)
+            .limit(limit + 1)
+            .all()
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "changes": [change_to_dict(c) for c in rows],
+            "next_since": rows[-1].Seq if rows else since,
+            "has_more": has_more
+        }
+
+    @app.get("/api/stream/events")
+    def stream_events():
+        last_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+        try:
+            since = int(last_id) if last_id else None
+        except ValueError:
+            return {"error": "Last-Event-ID must be an integer"}, 400
+
+        # Subscribe before replaying so nothing committed in between is lost;
+        # anything sent in the replay is skipped when it arrives live.
+        subscription = event_hub.subscribe()
+        if subscription is None:
+            return {"error": "Too many event streams, retry later"}, 503, {"Retry-After": "5"}
+
+        def generate():
+            replayed = set()
+            try:
+                yield "retry: 3000\n\n"
+                if since is not None:
+                    seen = since
+                    while True:
+                        events, upto = load_events(seen)
+                        for seq, name, data in events:
+                            replayed.add(seq)
+                            yield format_sse(seq, name, data)
+                        if upto == seen:
+                            break
+                        seen = upto
+                # Don't hold a pooled connection for the life of the stream.
+                db.session.close()
+
+                while True:
+                    try:
+                        item = subscription.get(timeout=15)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+                        continue
+                    if item is None:
+                        return
+                    seq, name, data = item
+                    if seq in replayed:
+                        replayed.discard(seq)
+                        continue
+                    yield format_sse(seq, name, data)
+            finally:
+                event_hub.unsubscribe(subscription)
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    if app.config["WARMUP"]:
+        warm_up(app)
+
     return app
 
 
@@ -0,0 +1,182 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, Table, delete, func, insert, select
+
+from changefeed import change_row, record_changes
+from models import db, Patient, Bill, Visit, Medication, Recommendation, normalize_treatment
+from rollups import apply_bill_deltas
+
+BATCH_SIZE = 500
+
+# Children first, so a patient row is never removed ahead of its records.
+ARCHIVED_MODELS = (Bill, Visit, Medication, Recommendation, Patient)
+
+archive_metadata = MetaData()
+
+
+def _archive_table(model):
+    # Same columns as the hot table, without its constraints. Child rows are
+    # keyed by (Patient_ID, own id): Patient_IDs are unique across shards,
+    # the children's own ids are not.
+    source = model.__table__
+    columns = [
+        Column(c.name, c.type, primary_key=c.name == "Patient_ID" or c.primary_key)
+        for c in source.columns
+    ]
+    if model is Patient:
+        columns.append(Column("Archived_At", DateTime, nullable=False))
+    return Table(f"ARCHIVE_{source.name}", archive_metadata, *columns)
+
+
+archive_tables = {model: _archive_table(model) for model in ARCHIVED_MODELS}
+
+
+class Archive:
+    # Discharged patients past the retention window, with everything they
+    # own, moved out of the hot tables. HMS_ARCHIVE_URI puts the archive in
+    # its own database; otherwise the ARCHIVE_* tables sit next to the hot ones.
+    # Analytics over patient history (census, admissions, length of stay)
+    # add the aggregates below to the hot ones, so archiving never changes
+    # their results.
+
+    def __init__(self, app, uri):
+        self.separate = bool(uri)
+        if uri:
+            app.config.setdefault("SQLALCHEMY_BINDS", {})["archive"] = uri
+
+    @property
+    def engine(self):
+        return db.engines["archive"] if self.separate else db.engine
+
+    def create_all(self):
+        archive_metadata.create_all(self.engine)
+
+    def patient(self, patient_id):
+        rows = self.rows(Patient, patient_id)
+        return rows[0] if rows else None
+
+    def rows(self, model, patient_id):
+        table = archive_tables[model]
+        columns = [table.c[c.name] for c in model.__table__.columns]
+        with self.engine.connect() as conn:
+            return [
+                dict(r._mapping)
+                for r in conn.execute(select(*columns).where(table.c.Patient_ID == patient_id))
+            ]
+
+    def admissions_by_day(self):
+        p = archive_tables[Patient]
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(p.c.AdmissionDate, func.count())
+                .where(p.c.AdmissionDate.isnot(None))
+                .group_by(p.c.AdmissionDate)
+            ).all()
+
+    def stays(self, start, end):
+        # (AdmissionDate, DischargeDate, Room_ID) of archived stays overlapping
+        # [start, end].
+        p = archive_tables[Patient]
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(p.c.AdmissionDate, p.c.DischargeDate, p.c.Room_ID)
+                .where(
+                    p.c.AdmissionDate.isnot(None),
+                    p.c.AdmissionDate <= end,
+                    p.c.DischargeDate.is_(None) | (p.c.DischargeDate > start)
+                )
+            ).all()
+
+    def length_of_stay(self):
+        # (total days, stays with a length).
+        p = archive_tables[Patient]
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(func.sum(p.c.Length_Of_Stay), func.count(p.c.Length_Of_Stay))
+            ).one()
+
+    def length_of_stay_by_treatment(self):
+        # (normalized name, display name, bills, total days), like the hot
+        # query. Catalog ids belong to the database a bill came from, so
+        # archived bills are grouped by their treatment text instead.
+        b, p = archive_tables[Bill], archive_tables[Patient]
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(b.c.Treatment, func.count(p.c.Length_Of_Stay), func.sum(p.c.Length_Of_Stay))
+                .join_from(b, p, p.c.Patient_ID == b.c.Patient_ID)
+                .where(p.c.Length_Of_Stay.isnot(None), b.c.Treatment.isnot(None))
+                .group_by(b.c.Treatment)
+            ).all()
+        out = []
+        for text, count, days in rows:
+            normalized = normalize_treatment(text)
+            if normalized is not None:
+                out.append((normalized, " ".join(text.split()), count, days))
+        return out
+
+    def run(self, session, cutoff, batch_size=None):
+        # Archives from one (shard) session until nothing is left to move;
+        # returns the number of patients archived.
+        batch_size = batch_size or BATCH_SIZE
+        total = 0
+        while True:
+            moved = self._batch(session, cutoff, batch_size)
+            if moved is None:
+                return total
+            total += moved
+
+    def _batch(self, session, cutoff, batch_size):
+        due = (Patient.Discharged.is_(True), Patient.DischargeDate < cutoff)
+        ids = session.scalars(
+            select(Patient.Patient_ID).where(*due).order_by(Patient.Patient_ID).limit(batch_size)
+        ).all()
+        if not ids:
+            return None
+        copied = {
+            model: [
+                dict(r._mapping)
+                for r in session.execute(
+                    select(model.__table__).where(model.__table__.c.Patient_ID.in_(ids))
+                )
+            ]
+            for model in ARCHIVED_MODELS
+        }
+        # End the read before writing: with SQLite the archive may be the
+        # same file.
+        session.rollback()
+
+        # Copy first, replacing any earlier copy, so a run interrupted after
+        # this commit just copies the batch again next time.
+        archived_at = datetime.now()
+        for row in copied[Patient]:
+            row["Archived_At"] = archived_at
+        with self.engine.begin() as conn:
+            for model, rows in copied.items():
+                table = archive_tables[model]
+                conn.execute(delete(table).where(table.c.Patient_ID.in_(ids)))
+                if rows:
+                    conn.execute(insert(table), rows)
+
+        # Only patients still due are removed, and only the child rows that
+        # were copied; anything written in between stays hot.
+        ids = set(session.scalars(
+            select(Patient.Patient_ID).where(Patient.Patient_ID.in_(ids), *due)
+        ))
+        changes = []
+        for model, rows in copied.items():
+            pk = model.__table__.primary_key.columns[0]
+            keys = [row[pk.name] for row in rows if row["Patient_ID"] in ids]
+            if not keys:
+                continue
+            session.execute(
+                delete(model).where(pk.in_(keys)).execution_options(synchronize_session=False)
+            )
+            changes.extend(change_row(model.__tablename__, key, "delete") for key in keys)
+            if model is Bill:
+                apply_bill_deltas(session.connection(), [
+                    (row["Treatment_ID"], row["Total_Amount"], -1)
+                    for row in rows if row["Patient_ID"] in ids
+                ])
+        record_changes(session, changes)
+        session.commit()
+        return len(ids)
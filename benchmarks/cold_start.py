@@ -0,0 +1,80 @@
+"""Time-to-first-request for a fresh worker, with and without warm-up.
+
+    python benchmarks/cold_start.py [--runs 5]
+
+Every run starts a new interpreter (as a gunicorn worker would), imports the
+app against a seeded SQLite file and times the import plus the first and
+second request on a few hot endpoints.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED = """
+from app import app
+c = app.test_client()
+c.get("/create_tables")
+c.post("/api/doctors", json={"Name": "D", "Salary": 1, "Specialty": "Cardiology"})
+c.post("/api/nurses", json={"Name": "N", "Salary": 1})
+c.post("/api/patients", json={"Name": "P", "AdmissionDate": "2024-01-01"})
+c.post("/api/bills", json={"Patient_ID": 1, "Treatment": "MRI", "Total_Amount": 100})
+"""
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+from app import app
+t1 = time.perf_counter()
+c = app.test_client()
+paths = ["/api/patients/1", "/api/doctors/1", "/api/patients/1/bills"]
+first, second = {}, {}
+for p in paths:
+    s = time.perf_counter(); c.get(p); first[p] = time.perf_counter() - s
+for p in paths:
+    s = time.perf_counter(); c.get(p); second[p] = time.perf_counter() - s
+print(json.dumps({
+    "import": t1 - t0,
+    "time_to_first_response": t1 - t0 + first[paths[0]],
+    "first": first,
+    "second": second,
+}))
+"""
+
+
+def run(code, env):
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1]) if out.strip() else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, HMS_DATABASE_URI=f"sqlite:///{tmp}/bench.db")
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+        run(SEED, env)
+
+        for warmup in ("0", "1"):
+            results = [run(PROBE, dict(env, WARMUP=warmup)) for _ in range(args.runs)]
+            print(f"WARMUP={warmup}  ({args.runs} runs, median ms)")
+            print(f"  import + create_app      {statistics.median(r['import'] for r in results) * 1000:8.2f}")
+            print(f"  time to first response   {statistics.median(r['time_to_first_response'] for r in results) * 1000:8.2f}")
+            for path in results[0]["first"]:
+                first = statistics.median(r["first"][path] for r in results) * 1000
+                second = statistics.median(r["second"][path] for r in results) * 1000
+                print(f"  {path:<24} first {first:7.2f}   second {second:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
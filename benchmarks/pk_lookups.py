@@ -0,0 +1,84 @@
+"""Per-call cost of primary-key lookups on the polymorphic staff models.
+
+    python benchmarks/pk_lookups.py [--rows 2000] [--calls 5000]
+
+Compares the legacy Query.get path with Session.get, plus the full
+GET /api/doctors/<id> round trip, and prints the compiled-statement cache
+hit ratio afterwards. The identity map is cleared before every call so each
+lookup really goes to the database.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(label, calls, fn):
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<28} {elapsed / calls * 1e6:8.1f} us/call  {calls / elapsed:9.0f} calls/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--calls", type=int, default=5000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["HMS_DATABASE_URI"] = f"sqlite:///{tmp}/bench.db"
+    sys.path.insert(0, ROOT)
+    from app import app
+    from metrics import metrics, statement_cache_hit_ratio
+    from models import db, Doctor, Nurse, Patient
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(
+            [Doctor(Name=f"D{i}", Salary=1, Specialty="Cardiology") for i in range(args.rows)]
+            + [Nurse(Name=f"N{i}", Salary=1) for i in range(args.rows)]
+            + [Patient(Name=f"P{i}") for i in range(args.rows)]
+        )
+        db.session.commit()
+        doctor_ids = [d.Doctor_ID for d in Doctor.query.all()]
+        nurse_ids = [n.Nurse_ID for n in Nurse.query.all()]
+        n = len(doctor_ids)
+
+        def legacy(model, ids):
+            def call(i):
+                db.session.expunge_all()
+                model.query.get(ids[i % n])
+            return call
+
+        def modern(model, ids):
+            def call(i):
+                db.session.expunge_all()
+                db.session.get(model, ids[i % n])
+            return call
+
+        print(f"{args.calls} lookups over {n} rows per model")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            timed("Doctor  Query.get (legacy)", args.calls, legacy(Doctor, doctor_ids))
+        timed("Doctor  Session.get", args.calls, modern(Doctor, doctor_ids))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            timed("Nurse   Query.get (legacy)", args.calls, legacy(Nurse, nurse_ids))
+        timed("Nurse   Session.get", args.calls, modern(Nurse, nurse_ids))
+        timed("Patient Session.get", args.calls, modern(Patient, list(range(1, n + 1))))
+
+    client = app.test_client()
+    timed("GET /api/doctors/<id>", args.calls, lambda i: client.get(f"/api/doctors/{doctor_ids[i % n]}"))
+
+    print(f"compiled cache hit ratio: {statement_cache_hit_ratio()}")
+    print(metrics.snapshot("sql.compiled_cache."))
+
+
+if __name__ == "__main__":
+    main()
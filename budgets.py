@@ -0,0 +1,121 @@
+import contextvars
+import sqlite3
+import time
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import Pool
+
+from admission import route_group
+from metrics import metrics
+from models import db
+
+# Monotonic deadline for the database work of the current request, if any.
+_deadline = contextvars.ContextVar("db_deadline", default=None)
+
+# SQLite calls the progress handler every this many VM instructions.
+PROGRESS_STEPS = 10000
+MYSQL_QUERY_TIMEOUT = 3024  # ER_QUERY_TIMEOUT
+
+
+def parse_budgets(spec):
+    # "default=5,analytics=20,export_table=0" -> seconds per endpoint or
+    # route group; 0 means no budget.
+    budgets = {}
+    for part in spec.split(","):
+        if part.strip():
+            name, _, seconds = part.partition("=")
+            budgets[name.strip()] = float(seconds)
+    return budgets
+
+
+def remaining():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _sqlite_progress():
+    # A non-zero return makes SQLite abort the statement with "interrupted".
+    deadline = _deadline.get()
+    return 1 if deadline is not None and time.monotonic() > deadline else 0
+
+
+def _on_connect(dbapi_conn, connection_record):
+    if isinstance(dbapi_conn, sqlite3.Connection):
+        dbapi_conn.set_progress_handler(_sqlite_progress, PROGRESS_STEPS)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # MySQL enforces MAX_EXECUTION_TIME on SELECTs only; writes are bounded
+    # by innodb_lock_wait_timeout instead.
+    left = remaining()
+    if left is not None and conn.dialect.name == "mysql":
+        head = statement.lstrip()
+        if head[:6].upper() == "SELECT":
+            statement = f"SELECT /*+ MAX_EXECUTION_TIME({max(int(left * 1000), 1)}) */{head[6:]}"
+    return statement, parameters
+
+
+def _timed_out(exc):
+    orig = getattr(exc, "orig", None)
+    if isinstance(orig, sqlite3.OperationalError):
+        return str(orig) == "interrupted"
+    return bool(orig is not None and orig.args and orig.args[0] == MYSQL_QUERY_TIMEOUT)
+
+
+def budget_exceeded(exc):
+    # True when exc is the database aborting a statement at the deadline, or
+    # the deadline has passed anyway; retrying can't help either way.
+    left = remaining()
+    return _timed_out(exc) or (left is not None and left <= 0)
+
+
+class TimeBudgets:
+    # Each request gets a deadline from DB_TIME_BUDGETS (its endpoint name,
+    # else its route group, else "default"); statements still running past
+    # it are aborted by the database and the request answers 504.
+
+    def __init__(self, app):
+        self.budgets = parse_budgets(app.config["DB_TIME_BUDGETS"])
+        if self.budgets:
+            app.before_request(self._start)
+            app.teardown_request(self._stop)
+            app.register_error_handler(OperationalError, self._handle)
+
+    def budget_for(self, req):
+        for key in (req.endpoint, route_group(req), "default"):
+            if key in self.budgets:
+                return key, self.budgets[key]
+        return None, 0
+
+    def _start(self):
+        key, seconds = self.budget_for(request)
+        if seconds > 0:
+            g.db_budget = (key, seconds)
+            _deadline.set(time.monotonic() + seconds)
+
+    def _stop(self, exc):
+        if g.pop("db_budget", None) is not None:
+            _deadline.set(None)
+
+    def _handle(self, exc):
+        budget = g.get("db_budget")
+        if budget is None or not budget_exceeded(exc):
+            raise exc
+        db.session.rollback()
+        key, seconds = budget
+        metrics.incr("db_budget.exceeded")
+        metrics.incr(f"db_budget.{key}.exceeded")
+        return {
+            "error": "Database time budget exceeded",
+            "endpoint": request.endpoint,
+            "budget_seconds": seconds
+        }, 504
+
+
+def init_time_budgets():
+    if not event.contains(Pool, "connect", _on_connect):
+        event.listen(Pool, "connect", _on_connect)
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute, retval=True)
@@ -0,0 +1,176 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from itertools import chain
+
+from flask import request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from shared_cache import SharedCache
+
+
+class TTLCache:
+    def __init__(self, maxsize=128, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, tables, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, valid=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if (
+                entry is None
+                or entry[0] <= time.monotonic()
+                or (valid is not None and not valid(entry[2]))
+            ):
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def set(self, key, value, tables=()):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, frozenset(tables), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_tables(self, tables):
+        tables = set(tables)
+        if not tables:
+            return
+        with self._lock:
+            stale = [k for k, (_, deps, _) in self._data.items() if deps & tables]
+            for k in stale:
+                del self._data[k]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+analytics_cache = TTLCache()
+shared_cache = None  # SharedCache, when SHARED_CACHE_PATH is configured
+
+# Tables some cached view depends on; writes to any other table are ignored.
+_cached_tables = set()
+
+
+def cached(*tables):
+    _cached_tables.update(tables)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = json.dumps([
+                view.__name__,
+                sorted(request.args.items(multi=True)),
+                sorted(kwargs.items()),
+            ])
+            if shared_cache is None:
+                hit, value = analytics_cache.get(key)
+                if hit:
+                    return value
+                value = view(*args, **kwargs)
+                analytics_cache.set(key, value, tables)
+                return value
+
+            # Local entries carry the shared table generations they were
+            # computed under, so a write in any worker retires them here too.
+            gens = shared_cache.generations(tables)
+            hit, entry = analytics_cache.get(key, valid=lambda e: e[0] == gens)
+            if hit:
+                return entry[1]
+            value, gens = shared_cache.get_or_compute(
+                key, tables, lambda: view(*args, **kwargs)
+            )
+            analytics_cache.set(key, (gens, value), tables)
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidate_tables(tables):
+    tables = set(tables) & _cached_tables
+    if not tables:
+        return
+    analytics_cache.invalidate_tables(tables)
+    if shared_cache is not None:
+        shared_cache.bump(tables)
+
+
+def _flushed_tables(session):
+    tables = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        tables.update(t.name for t in inspect(obj).mapper.tables)
+    return tables
+
+
+def _after_flush(session, flush_context):
+    tables = _flushed_tables(session)
+    invalidate_tables(tables)
+    # A reader may refill an entry from pre-commit data between flush and
+    # commit, so drop the same tables again once the transaction lands.
+    session.info.setdefault("cache_dirty_tables", set()).update(tables)
+
+
+def _do_orm_execute(state):
+    # Bulk UPDATE/DELETE statements never reach the flush, so catch them here.
+    if state.is_update or state.is_delete:
+        tables = {state.statement.table.name}
+        invalidate_tables(tables)
+        state.session.info.setdefault("cache_dirty_tables", set()).update(tables)
+
+
+def _after_commit(session):
+    invalidate_tables(session.info.pop("cache_dirty_tables", ()))
+
+
+def _after_rollback(session):
+    session.info.pop("cache_dirty_tables", None)
+
+
+def init_cache(app):
+    global shared_cache
+
+    analytics_cache.maxsize = app.config["ANALYTICS_CACHE_SIZE"]
+    analytics_cache.ttl = app.config["ANALYTICS_CACHE_TTL"]
+    if app.config["SHARED_CACHE_PATH"]:
+        shared_cache = SharedCache(
+            app.config["SHARED_CACHE_PATH"],
+            ttl=app.config["ANALYTICS_CACHE_TTL"],
+            maxsize=app.config["SHARED_CACHE_SIZE"],
+        )
+
+    if not event.contains(Session, "after_flush", _after_flush):
+        event.listen(Session, "after_flush", _after_flush)
+        event.listen(Session, "do_orm_execute", _do_orm_execute)
+        event.listen(Session, "after_commit", _after_commit)
+        event.listen(Session, "after_rollback", _after_rollback)
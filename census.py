@@ -0,0 +1,26 @@
+import numpy as np
+
+
+def daily_census(stays, start, end, groups=None):
+    # Sweep line over admission/discharge events. A patient counts as an
+    # inpatient on every day from admission up to, but not including, the
+    # discharge day; open stays run to the end of the range.
+    # stays: (admission_date, discharge_date or None) pairs.
+    # groups: optional group code (0..k-1) per stay; returns a (k, days) array.
+    days = (end - start).days + 1
+    first = start.toordinal()
+    admitted = np.array([a.toordinal() for a, _ in stays], dtype=np.int64) - first
+    discharged = np.array(
+        [d.toordinal() if d is not None else first + days for _, d in stays],
+        dtype=np.int64
+    ) - first
+    admitted = np.clip(admitted, 0, days)
+    discharged = np.clip(discharged, 0, days)
+
+    codes = np.zeros(len(stays), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+    k = int(codes.max()) + 1 if codes.size else 1
+    events = np.zeros((k, days + 1), dtype=np.int64)
+    np.add.at(events, (codes, admitted), 1)
+    np.add.at(events, (codes, discharged), -1)
+    census = np.cumsum(events, axis=1)[:, :days]
+    return census if groups is not None else census[0]
@@ -0,0 +1,109 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import event, inspect, insert
+from sqlalchemy.orm import Session
+
+from models import db, ChangeLog
+
+change_log = ChangeLog.__table__
+
+# Bookkeeping tables that clients never sync.
+UNTRACKED = {"CHANGE_LOG", "JOB", "TREATMENT_STATS"}
+
+
+def _encode(values):
+    return json.dumps(values, default=str, sort_keys=True) if values else None
+
+
+def _row_pk(state):
+    return ",".join(str(v) for v in state.mapper.primary_key_from_instance(state.obj()))
+
+
+def change_row(table, pk, operation, values=None):
+    return {
+        "Table_Name": table,
+        "Row_PK": str(pk),
+        "Operation": operation,
+        "Changes": _encode(values),
+        "Changed_At": datetime.now(),
+    }
+
+
+def _write(session, rows):
+    # CHANGE_LOG lives on the primary database only. Rows from a shard
+    # session can't join its transaction, so they are appended there right
+    # after the shard commits; everything else lands in the same transaction.
+    if "shard" in session.info:
+        session.info.setdefault("pending_changes", []).extend(rows)
+    else:
+        session.connection().execute(insert(change_log), rows)
+
+
+def record_changes(session, rows):
+    # For writes that bypass the flush (bulk UPDATE statements, core inserts);
+    # the rows land in the caller's transaction.
+    if rows:
+        _write(session, rows)
+
+
+def _after_flush(session, flush_context):
+    rows = []
+    for obj in session.new:
+        state = inspect(obj)
+        table = obj.__tablename__
+        if table in UNTRACKED:
+            continue
+        values = {attr.key: getattr(obj, attr.key) for attr in state.mapper.column_attrs}
+        rows.append(change_row(table, _row_pk(state), "insert", values))
+
+    for obj in session.dirty:
+        state = inspect(obj)
+        table = obj.__tablename__
+        if table in UNTRACKED or not session.is_modified(obj):
+            continue
+        values = {
+            attr.key: getattr(obj, attr.key)
+            for attr in state.mapper.column_attrs
+            if state.attrs[attr.key].history.has_changes()
+        }
+        if values:
+            rows.append(change_row(table, _row_pk(state), "update", values))
+
+    for obj in session.deleted:
+        state = inspect(obj)
+        table = obj.__tablename__
+        if table not in UNTRACKED:
+            rows.append(change_row(table, _row_pk(state), "delete"))
+
+    if rows:
+        _write(session, rows)
+
+
+def _after_commit(session):
+    rows = session.info.pop("pending_changes", None)
+    if rows:
+        with db.engine.begin() as conn:
+            conn.execute(insert(change_log), rows)
+
+
+def _after_rollback(session):
+    session.info.pop("pending_changes", None)
+
+
+def change_to_dict(c):
+    return {
+        "seq": c.Seq,
+        "table": c.Table_Name,
+        "pk": c.Row_PK,
+        "op": c.Operation,
+        "changes": json.loads(c.Changes) if c.Changes else None,
+        "at": c.Changed_At.isoformat(),
+    }
+
+
+def init_changefeed():
+    if not event.contains(Session, "after_flush", _after_flush):
+        event.listen(Session, "after_flush", _after_flush)
+        event.listen(Session, "after_commit", _after_commit)
+        event.listen(Session, "after_rollback", _after_rollback)
@@ -0,0 +1,130 @@
+import json
+import queue
+import threading
+import time
+
+from sqlalchemy import func
+
+from models import db, ChangeLog
+
+STREAMED_TABLES = ("ROOM", "PATIENT")
+# Seq values are handed out at insert but become visible at commit, so a
+# slow transaction can land behind rows already streamed. Each poll re-reads
+# this many Seqs behind the last one seen and skips those already published.
+RESCAN_WINDOW = 200
+
+
+def to_event(change):
+    # CHANGE_LOG row -> (event name, payload) for the station screens, or None.
+    values = json.loads(change.Changes) if change.Changes else {}
+    pk = int(change.Row_PK)
+    if change.Table_Name == "ROOM":
+        if change.Operation == "delete":
+            return "room_removed", {"Room_ID": pk}
+        if "Status" in values:
+            return "room_status", {"Room_ID": pk, "Status": values["Status"]}
+        return None
+
+    if change.Operation == "delete":
+        return None
+    if values.get("Discharged") or values.get("DischargeDate"):
+        return "discharge", {"Patient_ID": pk, **_pick(values, "DischargeDate", "Room_ID")}
+    if values.get("Admitted") or (change.Operation == "insert" and values.get("AdmissionDate")):
+        return "admission", {"Patient_ID": pk, **_pick(values, "AdmissionDate", "Room_ID")}
+    if "Room_ID" in values:
+        return "patient_room", {"Patient_ID": pk, "Room_ID": values["Room_ID"]}
+    return None
+
+
+def _pick(values, *keys):
+    return {k: values[k] for k in keys if k in values}
+
+
+def load_events(since, limit=500):
+    rows = (
+        ChangeLog.query
+        .filter(ChangeLog.Seq > since, ChangeLog.Table_Name.in_(STREAMED_TABLES))
+        .order_by(ChangeLog.Seq)
+        .limit(limit)
+        .all()
+    )
+    events = []
+    for row in rows:
+        event = to_event(row)
+        if event is not None:
+            events.append((row.Seq,) + event)
+    return events, (rows[-1].Seq if rows else since)
+
+
+class EventHub:
+    # One poller per worker process tails CHANGE_LOG and fans new events out
+    # to every connected client. Because each worker reads the shared log,
+    # a change committed through any worker reaches clients on all of them.
+
+    def __init__(self, app, poll_interval=1.0, queue_size=1000, max_subscribers=8):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(q)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._poll, name="hms-events", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def _publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # A client this far behind reconnects and resumes from its
+                # Last-Event-ID instead.
+                self.unsubscribe(q)
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait(None)
+
+    def _poll(self):
+        with self.app.app_context():
+            last = db.session.query(func.max(ChangeLog.Seq)).scalar() or 0
+            published = {e[0] for e in load_events(max(last - RESCAN_WINDOW, 0))[0]}
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            since = max(last - RESCAN_WINDOW, 0)
+            try:
+                with self.app.app_context():
+                    events, last = load_events(since)
+            except Exception:
+                self.app.logger.exception("event poll failed")
+                events = []
+            events = [e for e in events if e[0] not in published]
+            published = {seq for seq in published if seq > since}
+            for event in events:
+                published.add(event[0])
+                self._publish(event)
+            if not events:
+                time.sleep(self.poll_interval)
+
+
+def format_sse(seq, name, data):
+    return f"id: {seq}\nevent: {name}\ndata: {json.dumps(data, default=str)}\n\n"
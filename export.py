@@ -0,0 +1,105 @@
+from sqlalchemy import Boolean, Date, DateTime, Integer, Numeric, select
+
+from models import Patient, Bill, Visit
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only needed for exports
+    pa = pq = None
+
+EXPORT_MODELS = {"PATIENT": Patient, "BILL": Bill, "VISIT": Visit}
+FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.file", "arrow"),
+}
+CHUNK_SIZE = 10000
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+def _arrow_type(column):
+    t = column.type
+    if isinstance(t, Boolean):
+        return pa.bool_()
+    if isinstance(t, Integer):
+        return pa.int64()
+    if isinstance(t, Numeric):
+        return pa.decimal128(t.precision or 18, t.scale or 0)
+    if isinstance(t, DateTime):
+        return pa.timestamp("us")
+    if isinstance(t, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema(model):
+    if pa is None:
+        raise ExportUnavailable("pyarrow is not installed")
+    return pa.schema([
+        pa.field(c.name, _arrow_type(c), nullable=not c.primary_key)
+        for c in model.__table__.columns
+    ])
+
+
+def parse_after(raw, count):
+    # "12,,30" -> [12, None, 30]: one key per shard, as returned in
+    # X-Export-Last-Key; an empty entry exports that shard from the start.
+    if not raw:
+        return [None] * count
+    keys = [int(key) if key.strip() else None for key in raw.split(",")]
+    if len(keys) != count:
+        raise ValueError(f"expected {count} comma-separated keys, one per shard")
+    return keys
+
+
+def record_batches(session, model, schema, after=None, until=None, chunk_size=CHUNK_SIZE):
+    # Keyset pages over the primary key, each converted column by column,
+    # so memory stays bounded by one chunk whatever the table size.
+    table = model.__table__
+    pk = table.primary_key.columns[0]
+    last = after
+    while True:
+        q = select(table).order_by(pk).limit(chunk_size)
+        if last is not None:
+            q = q.where(pk > last)
+        if until is not None:
+            q = q.where(pk <= until)
+        rows = session.execute(q).all()
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+        last = rows[-1]._mapping[pk.name]
+        if len(rows) < chunk_size:
+            return
+
+
+def write_export(sink, fmt, model, sessions, after=None, until=None, chunk_size=CHUNK_SIZE):
+    # Writes each session's rows with keys in (after[i], until] to one file;
+    # returns the row count and the highest key exported per session, which
+    # is the `after` list for the next incremental run.
+    schema = arrow_schema(model)
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+    after = after or [None] * len(sessions)
+    rows, last_keys = 0, []
+    try:
+        for session, start in zip(sessions, after):
+            last = start
+            for batch in record_batches(session, model, schema, start, until, chunk_size):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+                last = batch.column(model.__table__.primary_key.columns[0].name)[-1].as_py()
+            last_keys.append(last)
+            session.rollback()
+    finally:
+        writer.close()
+    return rows, last_keys
@@ -0,0 +1,93 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+Z_95 = 1.96
+
+
+def daily_series(rows, end=None):
+    # rows: (date, count) pairs sorted by date. Days without admissions are
+    # filled with zeros so the series has one slot per calendar day, running
+    # through `end` when that is later than the last admission.
+    dates = np.array([d.toordinal() for d, _ in rows], dtype=np.int64)
+    counts = np.array([c for _, c in rows], dtype=np.float64)
+    start = rows[0][0]
+    last = max(dates[-1], end.toordinal()) if end is not None else dates[-1]
+    series = np.zeros(last - dates[0] + 1)
+    series[dates - dates[0]] = counts
+    return start, series
+
+
+def _interval(point, residuals, widen):
+    sigma = residuals.std() if residuals.size else 0.0
+    half = Z_95 * sigma * (np.sqrt(np.arange(1, point.size + 1)) if widen else 1.0)
+    return np.maximum(point - half, 0.0), point + half
+
+
+def moving_average(series, window=5, horizon=7):
+    window = max(1, min(window, series.size))
+    csum = np.concatenate(([0.0], np.cumsum(series)))
+    means = (csum[window:] - csum[:-window]) / window
+    # means[i] covers series[i:i + window] and predicts series[i + window].
+    residuals = series[window:] - means[:-1]
+    point = np.full(horizon, means[-1])
+    return (point,) + _interval(point, residuals, widen=True)
+
+
+def exponential_smoothing(series, alpha=0.3, horizon=7):
+    # level[t] = alpha * x[t] + (1 - alpha) * level[t - 1], with level[0] = x[0],
+    # unrolled into a convolution with geometrically decaying weights. Weights
+    # below 1e-12 are dropped, so the cost stays linear in the series length.
+    n = series.size
+    alpha = min(max(alpha, 0.01), 1.0)
+    decay = 1.0 - alpha
+    if decay > 0:
+        k = min(n, int(np.ceil(np.log(1e-12) / np.log(decay))) + 1)
+    else:
+        k = 1
+    weights = alpha * decay ** np.arange(k)
+    level = np.convolve(series, weights)[:n]
+    level += decay ** (np.arange(n) + 1) * series[0]
+    residuals = series[1:] - level[:-1]
+    point = np.full(horizon, level[-1])
+    return (point,) + _interval(point, residuals, widen=True)
+
+
+def seasonal(series, start, horizon=7, weeks=8):
+    # Mean admissions per weekday over the most recent `weeks` weeks.
+    recent = series[-weeks * 7:]
+    first = start.toordinal() + series.size - recent.size
+    weekday = (first + np.arange(recent.size)) % 7
+    totals = np.bincount(weekday, weights=recent, minlength=7)
+    days = np.bincount(weekday, minlength=7)
+    profile = np.divide(totals, days, out=np.full(7, recent.mean()), where=days > 0)
+    residuals = recent - profile[weekday]
+    future = (start.toordinal() + series.size + np.arange(horizon)) % 7
+    point = profile[future]
+    return (point,) + _interval(point, residuals, widen=False)
+
+
+def forecast(rows, horizon=7, window=5, alpha=0.3, today=None):
+    # Forecasts start the day after today; the quiet days since the last
+    # admission count as zeros.
+    start, series = daily_series(rows, today or date.today())
+    first_day = start + timedelta(days=series.size)
+    dates = [str(first_day + timedelta(days=i)) for i in range(horizon)]
+
+    methods = {
+        "moving_average": moving_average(series, window, horizon),
+        "exponential_smoothing": exponential_smoothing(series, alpha, horizon),
+        "seasonal": seasonal(series, start, horizon),
+    }
+    return {
+        name: [
+            {
+                "date": d,
+                "predicted": round(float(p), 2),
+                "lower": round(float(lo), 2),
+                "upper": round(float(hi), 2)
+            }
+            for d, p, lo, hi in zip(dates, point, lower, upper)
+        ]
+        for name, (point, lower, upper) in methods.items()
+    }
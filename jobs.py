@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from models import db, Job
+
+# Job name -> analytics endpoint it runs.
+ANALYTICS_JOBS = {
+    "patient_flow": "patient_flow",
+    "resource_optimization": "resource_optimization",
+    "resource_optimization_v2": "resource_optimization_v2",
+    "room_shortage_forecast": "room_shortage_forecast",
+    "census": "census",
+}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobRunner:
+    def __init__(self, app):
+        self.app = app
+        self.max_workers = app.config["JOB_WORKERS"]
+        self.max_pending = app.config["JOB_QUEUE_LIMIT"]
+        self.ttl = timedelta(seconds=app.config["JOB_RESULT_TTL"])
+        self.lease = timedelta(seconds=app.config["JOB_LEASE"])
+        self._executor = None
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Created on first use so each gunicorn worker gets its own threads.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="hms-job"
+                )
+            return self._executor
+
+    def submit(self, name, params):
+        # Returns (job, created). A finished job for the same report and
+        # parameters is reused until its result expires, and a queued or
+        # running one while its lease holds. Expires_At is the lease for
+        # unfinished jobs, so one whose worker died stops being reused after
+        # JOB_LEASE seconds and is marked failed.
+        now = datetime.now()
+        encoded = json.dumps(params, sort_keys=True)
+        params_hash = hashlib.sha256(f"{name}:{encoded}".encode()).hexdigest()
+
+        Job.query.filter(
+            Job.Status.in_(("done", "failed")), Job.Expires_At <= now
+        ).delete(synchronize_session=False)
+        Job.query.filter(
+            Job.Status.in_(("queued", "running")), Job.Expires_At <= now
+        ).update({
+            "Status": "failed",
+            "Error": json.dumps({"error": "Job was abandoned by its worker"}),
+            "Finished_At": now,
+            "Expires_At": now + self.ttl
+        }, synchronize_session=False)
+        existing = (
+            Job.query
+            .filter(
+                Job.Params_Hash == params_hash,
+                Job.Status != "failed",
+                Job.Expires_At > now
+            )
+            .order_by(Job.Created_At.desc())
+            .first()
+        )
+        if existing is not None:
+            db.session.commit()
+            return existing, False
+
+        if not self._pending.acquire(blocking=False):
+            db.session.rollback()
+            raise QueueFull()
+
+        job = Job(
+            Job_ID=uuid.uuid4().hex,
+            Name=name,
+            Params=encoded,
+            Params_Hash=params_hash,
+            Status="queued",
+            Created_At=now,
+            Expires_At=now + self.lease
+        )
+        try:
+            db.session.add(job)
+            db.session.commit()
+            self._pool().submit(self._run, job.Job_ID, ANALYTICS_JOBS[name], params)
+        except Exception:
+            db.session.rollback()
+            self._pending.release()
+            raise
+        return job, True
+
+    def _set(self, job_id, **values):
+        Job.query.filter_by(Job_ID=job_id).update(values, synchronize_session=False)
+        db.session.commit()
+
+    def _run(self, job_id, endpoint, params):
+        try:
+            with self.app.test_request_context(query_string=params):
+                self._set(job_id, Status="running", Expires_At=datetime.now() + self.lease)
+                try:
+                    response = self.app.make_response(self.app.view_functions[endpoint]())
+                    body = response.get_json()
+                    failed = response.status_code >= 400
+                except Exception as exc:
+                    db.session.rollback()
+                    body, failed = {"error": str(exc)}, True
+
+                finished = datetime.now()
+                self._set(
+                    job_id,
+                    Status="failed" if failed else "done",
+                    Result=None if failed else json.dumps(body),
+                    Error=json.dumps(body) if failed else None,
+                    Finished_At=finished,
+                    Expires_At=finished + self.ttl
+                )
+        finally:
+            self._pending.release()
+
+
+def job_to_dict(job):
+    out = {
+        "job_id": job.Job_ID,
+        "name": job.Name,
+        "params": json.loads(job.Params),
+        "status": job.Status,
+        "created_at": job.Created_At.isoformat(),
+        "finished_at": job.Finished_At.isoformat() if job.Finished_At else None,
+        "expires_at": job.Expires_At.isoformat(),
+    }
+    if job.Status == "done":
+        out["result"] = json.loads(job.Result)
+    elif job.Status == "failed":
+        out["error"] = json.loads(job.Error)
+    return out
@@ -0,0 +1,49 @@
+import threading
+from collections import Counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, default
+
+
+class Metrics:
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self._counts[name] += n
+
+    def snapshot(self, prefix=""):
+        with self._lock:
+            return {k: v for k, v in sorted(self._counts.items()) if k.startswith(prefix)}
+
+
+metrics = Metrics()
+
+
+_CACHE_OUTCOMES = {
+    default.CACHE_HIT: "sql.compiled_cache.hit",
+    default.CACHE_MISS: "sql.compiled_cache.miss",
+    default.CACHING_DISABLED: "sql.compiled_cache.disabled",
+    default.NO_CACHE_KEY: "sql.compiled_cache.no_key",
+    default.NO_DIALECT_SUPPORT: "sql.compiled_cache.no_dialect_support",
+}
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    outcome = _CACHE_OUTCOMES.get(getattr(context, "cache_hit", None))
+    if outcome:
+        metrics.incr(outcome)
+
+
+def statement_cache_hit_ratio():
+    counts = metrics.snapshot("sql.compiled_cache.")
+    hits = counts.get("sql.compiled_cache.hit", 0)
+    misses = counts.get("sql.compiled_cache.miss", 0)
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+
+def init_sql_metrics():
+    if not event.contains(Engine, "after_cursor_execute", _count_statement):
+        event.listen(Engine, "after_cursor_execute", _count_statement)
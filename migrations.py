@@ -0,0 +1,125 @@
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, inspect, select, text, update
+
+from models import (
+    db, Bill, Patient, Treatment, TreatmentStats,
+    length_of_stay, normalize_treatment
+)
+from rollups import rebuild_treatment_stats
+
+BATCH_SIZE = 1000
+
+schema_migrations = db.Table(
+    "SCHEMA_MIGRATIONS",
+    db.Column("Name", db.String(100), primary_key=True),
+    db.Column("Applied_At", db.DateTime, nullable=False),
+)
+
+
+def _add_column(conn, table, column):
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    if column.name not in existing:
+        col_type = column.type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
+
+def patient_length_of_stay(conn):
+    patients = Patient.__table__
+    _add_column(conn, patients, patients.c.Length_Of_Stay)
+    for ix in patients.indexes:
+        ix.create(conn, checkfirst=True)
+
+    stmt = (
+        update(patients)
+        .where(patients.c.Patient_ID == bindparam("pid"))
+        .values(Length_Of_Stay=bindparam("los"))
+    )
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(patients.c.Patient_ID, patients.c.AdmissionDate, patients.c.DischargeDate)
+            .where(
+                patients.c.Patient_ID > last_id,
+                patients.c.AdmissionDate.isnot(None),
+                patients.c.DischargeDate.isnot(None),
+            )
+            .order_by(patients.c.Patient_ID)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        conn.execute(stmt, [
+            {"pid": pid, "los": length_of_stay(adm, dis)} for pid, adm, dis in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def treatment_catalog(conn):
+    bills = Bill.__table__
+    treatments = Treatment.__table__
+    treatments.create(conn, checkfirst=True)
+    _add_column(conn, bills, bills.c.Treatment_ID)
+    for ix in bills.indexes:
+        ix.create(conn, checkfirst=True)
+
+    known = dict(conn.execute(select(treatments.c.Normalized_Name, treatments.c.Treatment_ID)).all())
+    raw_names = conn.scalars(
+        select(bills.c.Treatment).where(bills.c.Treatment.isnot(None)).distinct()
+    ).all()
+
+    assignments = []
+    for raw in raw_names:
+        key = normalize_treatment(raw)
+        if key is None:
+            continue
+        if key not in known:
+            known[key] = conn.execute(
+                insert(treatments).values(Name=" ".join(raw.split()), Normalized_Name=key)
+            ).inserted_primary_key[0]
+        assignments.append({"raw": raw, "tid": known[key]})
+
+    stmt = (
+        update(bills)
+        .where(bills.c.Treatment == bindparam("raw"))
+        .values(Treatment_ID=bindparam("tid"))
+    )
+    for i in range(0, len(assignments), BATCH_SIZE):
+        conn.execute(stmt, assignments[i:i + BATCH_SIZE])
+
+    TreatmentStats.__table__.drop(conn, checkfirst=True)
+    TreatmentStats.__table__.create(conn)
+    rebuild_treatment_stats(conn)
+
+
+MIGRATIONS = [
+    ("0001_patient_length_of_stay", patient_length_of_stay),
+    ("0003_treatment_catalog", treatment_catalog),
+]
+
+
+def _create_missing_indexes(conn):
+    for table in db.metadata.sorted_tables:
+        for ix in table.indexes:
+            ix.create(conn, checkfirst=True)
+
+
+def run_migrations():
+    # Each migration runs once in its own transaction; indexes declared on
+    # the models are created on existing tables every time.
+    schema_migrations.create(db.engine, checkfirst=True)
+    with db.engine.connect() as conn:
+        done = set(conn.scalars(select(schema_migrations.c.Name)))
+
+    applied = []
+    for name, migrate in MIGRATIONS:
+        if name in done:
+            continue
+        with db.engine.begin() as conn:
+            migrate(conn)
+            conn.execute(schema_migrations.insert().values(Name=name, Applied_At=datetime.now()))
+        applied.append(name)
+
+    with db.engine.begin() as conn:
+        _create_missing_indexes(conn)
+    return applied
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import event
 
 db = SQLAlchemy()
 
@@ -78,6 +79,11 @@ class Room(db.Model):
 
     Nurse_ID = db.Column(db.Integer, db.ForeignKey("NURSE.Nurse_ID"))
 
+    __table_args__ = (
+        db.Index("ix_room_type_status", "Room_Type", "Status"),
+        db.Index("ix_room_nurse_status", "Nurse_ID", "Status"),
+    )
+
 
 class Patient(db.Model):
     __tablename__ = "PATIENT"
@@ -94,9 +100,27 @@ class Patient(db.Model):
     Discharged = db.Column(db.Boolean, default=False)
     AdmissionDate = db.Column(db.Date, nullable=True)
     DischargeDate = db.Column(db.Date, nullable=True)
+    Length_Of_Stay = db.Column(db.Integer, nullable=True, index=True)  # days
 
     Room_ID = db.Column(db.Integer, db.ForeignKey("ROOM.Room_ID"))
 
+    __table_args__ = (
+        db.Index("ix_patient_admission_discharge", "AdmissionDate", "DischargeDate"),
+        db.Index("ix_patient_room_discharged", "Room_ID", "Discharged"),
+    )
+
+
+def length_of_stay(admission_date, discharge_date):
+    if admission_date is None or discharge_date is None:
+        return None
+    return (discharge_date - admission_date).days
+
+
+@event.listens_for(Patient, "before_insert")
+@event.listens_for(Patient, "before_update")
+def _sync_length_of_stay(mapper, connection, target):
+    target.Length_Of_Stay = length_of_stay(target.AdmissionDate, target.DischargeDate)
+
 
 class Medication(db.Model):
     __tablename__ = "MEDICATION"
@@ -104,18 +128,44 @@ class Medication(db.Model):
     Medication_ID = db.Column(db.Integer, primary_key=True)
     Name = db.Column(db.String(100))
     Dosage = db.Column(db.String(100))
-    Patient_ID = db.Column(db.Integer, db.ForeignKey("PATIENT.Patient_ID"))
+    Patient_ID = db.Column(db.Integer, db.ForeignKey("PATIENT.Patient_ID"), index=True)
+
+
+def normalize_treatment(name):
+    if name is None:
+        return None
+    return " ".join(name.split()).casefold() or None
+
+
+class Treatment(db.Model):
+    __tablename__ = "TREATMENT"
+
+    Treatment_ID = db.Column(db.Integer, primary_key=True)
+    Name = db.Column(db.String(255), nullable=False)
+    Normalized_Name = db.Column(db.String(255), nullable=False, unique=True)
 
 
 class Bill(db.Model):
     __tablename__ = "BILL"
 
     Bill_ID = db.Column(db.Integer, primary_key=True)
-    Patient_ID = db.Column(db.Integer)
-    Treatment = db.Column(db.Text)
+    Patient_ID = db.Column(db.Integer, index=True)
+    Treatment = db.Column(db.Text)  # as entered; grouped via Treatment_ID
+    Treatment_ID = db.Column(db.Integer, db.ForeignKey("TREATMENT.Treatment_ID"), index=True)
     Total_Amount = db.Column(db.Numeric(12, 2))
 
 
+class TreatmentStats(db.Model):
+    __tablename__ = "TREATMENT_STATS"
+
+    # Running per-treatment aggregates over BILL, maintained by rollups.py.
+    Treatment_ID = db.Column(db.Integer, db.ForeignKey("TREATMENT.Treatment_ID"), primary_key=True)
+    Bill_Count = db.Column(db.Integer, nullable=False, default=0)
+    Total_Sum = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    Min_Amount = db.Column(db.Numeric(12, 2))
+    Max_Amount = db.Column(db.Numeric(12, 2))
+
+
 class Visit(db.Model):
     __tablename__ = "VISIT"
 
@@ -125,12 +175,18 @@ class Visit(db.Model):
     VisitDate = db.Column(db.Date)
     Notes = db.Column(db.Text)
 
+    __table_args__ = (
+        # Also serves plain Patient_ID lookups.
+        db.Index("ix_visit_patient_date", "Patient_ID", "VisitDate", "Visit_ID"),
+        db.Index("ix_visit_doctor_date", "Doctor_ID", "VisitDate"),
+    )
+
 
 class Recommendation(db.Model):
     __tablename__ = "RECOMMENDATION"
 
     Rec_ID = db.Column(db.Integer, primary_key=True)
-    Patient_ID = db.Column(db.Integer)
+    Patient_ID = db.Column(db.Integer, index=True)
     Text = db.Column(db.Text)
 
 
@@ -142,6 +198,11 @@ class Schedule(db.Model):
     WorkDate = db.Column(db.Date)
     Shift = db.Column(db.String(50))
 
+    __table_args__ = (
+        db.Index("ix_schedule_date_employee", "WorkDate", "Employee_ID"),
+        db.Index("ix_schedule_employee_date", "Employee_ID", "WorkDate"),
+    )
+
 
 class Resource(db.Model):
     __tablename__ = "RESOURCE"
@@ -150,3 +211,32 @@ class Resource(db.Model):
     Name = db.Column(db.String(100))
     Quantity = db.Column(db.Integer)
     Status = db.Column(db.String(50))
+
+
+class Job(db.Model):
+    __tablename__ = "JOB"
+
+    Job_ID = db.Column(db.String(32), primary_key=True)
+    Name = db.Column(db.String(100), nullable=False)
+    Params = db.Column(db.Text, nullable=False)  # canonical JSON
+    Params_Hash = db.Column(db.String(64), nullable=False, index=True)
+    Status = db.Column(db.String(20), nullable=False)  # queued / running / done / failed
+    Result = db.Column(db.Text)
+    Error = db.Column(db.Text)
+    Created_At = db.Column(db.DateTime, nullable=False)
+    Finished_At = db.Column(db.DateTime)
+    Expires_At = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class ChangeLog(db.Model):
+    __tablename__ = "CHANGE_LOG"
+
+    Seq = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    Table_Name = db.Column(db.String(50), nullable=False)
+    Row_PK = db.Column(db.String(100), nullable=False)
+    Operation = db.Column(db.String(10), nullable=False)  # insert / update / delete
+    Changes = db.Column(db.Text)  # JSON of the written columns
+    Changed_At = db.Column(db.DateTime, nullable=False)
+
+    # AUTOINCREMENT stops SQLite from reusing sequence numbers.
+    __table_args__ = {"sqlite_autoincrement": True}
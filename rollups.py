@@ -0,0 +1,142 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import case, delete, event, func, inspect, insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import Bill, TreatmentStats
+
+stats = TreatmentStats.__table__
+
+
+def _amount(value):
+    return None if value is None else Decimal(str(value))
+
+
+def _original(obj, attr):
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr)
+
+
+def _bill_deltas(session):
+    # (Treatment_ID, amount, +1/-1) for every bill row added, removed or changed.
+    deltas = []
+    for obj in session.new:
+        if isinstance(obj, Bill):
+            deltas.append((obj.Treatment_ID, _amount(obj.Total_Amount), 1))
+    for obj in session.deleted:
+        if isinstance(obj, Bill):
+            deltas.append((_original(obj, "Treatment_ID"), _amount(_original(obj, "Total_Amount")), -1))
+    for obj in session.dirty:
+        if isinstance(obj, Bill) and session.is_modified(obj):
+            old = (_original(obj, "Treatment_ID"), _amount(_original(obj, "Total_Amount")))
+            new = (obj.Treatment_ID, _amount(obj.Total_Amount))
+            if old != new:
+                deltas.append(old + (-1,))
+                deltas.append(new + (1,))
+    return [d for d in deltas if d[0] is not None and d[1] is not None]
+
+
+def _upsert(conn, values, row):
+    # One statement, so two writers adding a treatment's first bills can't
+    # both find no row and both insert it.
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        return mysql.insert(stats).values(**row).on_duplicate_key_update(**values)
+    if dialect in ("sqlite", "postgresql"):
+        module = sqlite if dialect == "sqlite" else postgresql
+        return module.insert(stats).values(**row).on_conflict_do_update(
+            index_elements=[stats.c.Treatment_ID], set_=values
+        )
+    raise NotImplementedError(f"no upsert for {dialect}")
+
+
+def _apply(conn, treatment, changes):
+    added = [amount for amount, sign in changes if sign > 0]
+    removed = [amount for amount, sign in changes if sign < 0]
+    count_delta = len(added) - len(removed)
+    sum_delta = sum(added, Decimal(0)) - sum(removed, Decimal(0))
+
+    # Counters move with in-place arithmetic so concurrent writers never
+    # overwrite each other's increments.
+    values = {
+        "Bill_Count": stats.c.Bill_Count + count_delta,
+        "Total_Sum": stats.c.Total_Sum + sum_delta,
+    }
+    if added:
+        lo, hi = min(added), max(added)
+        values["Min_Amount"] = case(
+            (stats.c.Min_Amount.is_(None) | (stats.c.Min_Amount > lo), lo),
+            else_=stats.c.Min_Amount,
+        )
+        values["Max_Amount"] = case(
+            (stats.c.Max_Amount.is_(None) | (stats.c.Max_Amount < hi), hi),
+            else_=stats.c.Max_Amount,
+        )
+
+    conn.execute(_upsert(conn, values, {
+        "Treatment_ID": treatment,
+        "Bill_Count": count_delta,
+        "Total_Sum": sum_delta,
+        "Min_Amount": min(added) if added else None,
+        "Max_Amount": max(added) if added else None,
+    }))
+
+    if removed:
+        row = conn.execute(
+            select(stats.c.Bill_Count, stats.c.Min_Amount, stats.c.Max_Amount)
+            .where(stats.c.Treatment_ID == treatment)
+        ).one()
+        if row.Bill_Count <= 0:
+            conn.execute(delete(stats).where(stats.c.Treatment_ID == treatment))
+        elif min(removed) <= row.Min_Amount or max(removed) >= row.Max_Amount:
+            # An extreme may have been removed; only then rescan the bills.
+            lo, hi = conn.execute(
+                select(func.min(Bill.Total_Amount), func.max(Bill.Total_Amount))
+                .where(Bill.Treatment_ID == treatment, Bill.Total_Amount.isnot(None))
+            ).one()
+            conn.execute(
+                update(stats).where(stats.c.Treatment_ID == treatment)
+                .values(Min_Amount=lo, Max_Amount=hi)
+            )
+
+
+def apply_bill_deltas(conn, deltas):
+    # deltas: (Treatment_ID, amount, +1/-1). Also used by writers that move
+    # BILL rows without the ORM; call it after the rows have changed.
+    grouped = defaultdict(list)
+    for treatment, amount, sign in deltas:
+        if treatment is not None and amount is not None:
+            grouped[treatment].append((_amount(amount), sign))
+    for treatment, changes in grouped.items():
+        _apply(conn, treatment, changes)
+
+
+def _after_flush(session, flush_context):
+    deltas = _bill_deltas(session)
+    if deltas:
+        apply_bill_deltas(session.connection(), deltas)
+
+
+def rebuild_treatment_stats(conn):
+    conn.execute(delete(stats))
+    conn.execute(insert(stats).from_select(
+        ["Treatment_ID", "Bill_Count", "Total_Sum", "Min_Amount", "Max_Amount"],
+        select(
+            Bill.Treatment_ID,
+            func.count(Bill.Total_Amount),
+            func.sum(Bill.Total_Amount),
+            func.min(Bill.Total_Amount),
+            func.max(Bill.Total_Amount),
+        )
+        .where(Bill.Treatment_ID.isnot(None), Bill.Total_Amount.isnot(None))
+        .group_by(Bill.Treatment_ID)
+    ))
+
+
+def init_rollups():
+    if not event.contains(Session, "after_flush", _after_flush):
+        event.listen(Session, "after_flush", _after_flush)
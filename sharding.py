@@ -0,0 +1,310 @@
+import contextvars
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort, g
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, Patient, Bill, Visit, Medication, Recommendation, Treatment
+from rollups import rebuild_treatment_stats
+
+# Everything a patient owns, plus the per-database bookkeeping that the
+# session hooks write alongside it (catalog, rollups). The change log stays
+# on the primary database.
+SHARDED_TABLES = (
+    "PATIENT", "BILL", "VISIT", "MEDICATION", "RECOMMENDATION",
+    "TREATMENT", "TREATMENT_STATS",
+)
+
+# Rows whose ids must be unique across shards; the catalog is per shard.
+# Parents first, the order rows are moved onto the shards in.
+ALLOCATED_MODELS = (Patient, Bill, Visit, Medication, Recommendation)
+MIGRATE_BATCH_SIZE = 1000
+
+
+def _shard_metadata():
+    metadata = MetaData()
+    for name in SHARDED_TABLES:
+        db.metadata.tables[name].to_metadata(metadata)
+
+    # Rooms and staff stay on the primary database, so references to them
+    # can't be enforced on a shard.
+    for table in metadata.tables.values():
+        for fk in list(table.foreign_key_constraints):
+            if fk.elements[0].target_fullname.split(".")[0] not in SHARDED_TABLES:
+                table.constraints.discard(fk)
+                for element in fk.elements:
+                    element.parent.foreign_keys.discard(element)
+                    table.foreign_keys.discard(element)
+    return metadata
+
+
+shard_metadata = _shard_metadata()
+
+id_sequences = Table(
+    "ID_SEQ", shard_metadata,
+    Column("Name", String(50), primary_key=True),
+    Column("Next_Value", Integer, nullable=False),
+)
+
+
+def _assign_ids(session, flush_context, instances):
+    router = session.info.get("shard_router")
+    if router is None:
+        return
+    for obj in session.new:
+        if isinstance(obj, ALLOCATED_MODELS):
+            pk = obj.__mapper__.primary_key[0]
+            if getattr(obj, pk.key) is None:
+                setattr(obj, pk.key, router.next_id(session, session.info["shard"], type(obj)))
+
+
+class ShardRouter:
+    # Patients live on shard Patient_ID % count, and ids are handed out per
+    # shard so that holds for every id it creates: any per-patient request
+    # reaches its shard from the id alone. Bills, visits, medications and
+    # recommendations get ids the same way, so they are unique across shards
+    # too. The shard count is therefore fixed
+    # once data exists. With no shards configured every call falls through to
+    # db.session, so handlers are written once for both layouts.
+
+    def __init__(self, app, uris):
+        self.keys = [f"shard{i}" for i in range(len(uris))]
+        self.count = len(uris)
+        self._next = itertools.count()
+        self._executor = None
+        self._lock = threading.Lock()
+        if uris:
+            app.config.setdefault("SQLALCHEMY_BINDS", {}).update(zip(self.keys, uris))
+            app.teardown_appcontext(self._close_sessions)
+            if not event.contains(Session, "before_flush", _assign_ids):
+                event.listen(Session, "before_flush", _assign_ids)
+
+    @property
+    def enabled(self):
+        return self.count > 0
+
+    def shard_of(self, patient_id):
+        return int(patient_id) % self.count
+
+    def place(self, hospital_id=None):
+        # New patients go to their hospital's shard when one is given,
+        # otherwise round-robin. A Hospital_ID that isn't an integer raises
+        # ValueError or TypeError, sharded or not.
+        if hospital_id is not None:
+            hospital_id = int(hospital_id)
+        if not self.enabled:
+            return 0
+        if hospital_id is not None:
+            return hospital_id % self.count
+        return next(self._next) % self.count
+
+    def session(self, shard):
+        if not self.enabled:
+            return db.session
+        sessions = g.setdefault("shard_sessions", {})
+        if shard not in sessions:
+            sessions[shard] = self._open(shard)
+        return sessions[shard]
+
+    def sessions(self):
+        return [self.session(shard) for shard in range(max(self.count, 1))]
+
+    def session_for(self, patient_id):
+        if not self.enabled or patient_id is None:
+            return self.session(0)
+        return self.session(self.shard_of(patient_id))
+
+    def get_or_404(self, model, patient_id):
+        row = self.session_for(patient_id).get(model, patient_id)
+        if row is None:
+            abort(404)
+        return row
+
+    def group(self, patient_ids):
+        # shard -> the ids that live there, in their original order.
+        grouped = {}
+        for pid in patient_ids:
+            grouped.setdefault(self.shard_of(pid) if self.enabled else 0, []).append(pid)
+        return grouped
+
+    def _open(self, shard):
+        # Shard sessions are tagged so the session hooks know where they write.
+        return Session(db.engines[self.keys[shard]], info={"shard": shard, "shard_router": self})
+
+    def next_id(self, session, shard, model):
+        # value * count + shard from a per-shard counter per table. A new
+        # counter starts above the table's current ids.
+        name = model.__tablename__
+        conn = session.connection()
+        for _ in range(2):
+            bumped = conn.execute(
+                update(id_sequences)
+                .where(id_sequences.c.Name == name)
+                .values(Next_Value=id_sequences.c.Next_Value + 1)
+            ).rowcount
+            if bumped:
+                value = conn.scalar(
+                    select(id_sequences.c.Next_Value).where(id_sequences.c.Name == name)
+                )
+                return value * self.count + shard
+            pk = model.__table__.primary_key.columns[0]
+            value = (conn.scalar(select(func.max(pk))) or 0) // self.count + 1
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(id_sequences).values(Name=name, Next_Value=value))
+                return value * self.count + shard
+            except IntegrityError:
+                # Another writer created the counter first; bump it instead.
+                continue
+        raise RuntimeError(f"could not allocate a {name} id on shard {shard}")
+
+    def migrate_primary(self, batch_size=None):
+        # Moves patient data written before sharding was enabled from the
+        # primary onto shard Patient_ID % count (rows without a patient go
+        # to shard 0, where session_for looks for them), then starts every
+        # shard's id counters above the moved ids. Rows are copied in batches
+        # and only deleted from the primary once all are copied, so an
+        # interrupted run is simply run again. Run it while no app worker
+        # writes patient data. Returns {table name: rows moved}.
+        batch_size = batch_size or MIGRATE_BATCH_SIZE
+        catalog = {
+            tid: (normalized, name)
+            for tid, normalized, name in db.session.execute(
+                select(Treatment.Treatment_ID, Treatment.Normalized_Name, Treatment.Name)
+            )
+        }
+        db.session.rollback()
+        shard_catalogs = [{} for _ in self.keys]
+        moved = {}
+        for model in ALLOCATED_MODELS:
+            table = model.__table__
+            pk = table.primary_key.columns[0]
+            moved[table.name] = 0
+            last = None
+            while True:
+                q = select(table).order_by(pk).limit(batch_size)
+                if last is not None:
+                    q = q.where(pk > last)
+                with db.engine.connect() as primary:
+                    rows = [dict(r._mapping) for r in primary.execute(q)]
+                if not rows:
+                    break
+                by_shard = {}
+                for row in rows:
+                    pid = row["Patient_ID"]
+                    by_shard.setdefault(0 if pid is None else self.shard_of(pid), []).append(row)
+                for shard, shard_rows in by_shard.items():
+                    with db.engines[self.keys[shard]].begin() as conn:
+                        if model is Bill:
+                            for row in shard_rows:
+                                row["Treatment_ID"] = self._shard_treatment(
+                                    conn, shard_catalogs[shard], catalog, row["Treatment_ID"]
+                                )
+                        # A row already there is a copy from an earlier run;
+                        # a different row with the same id was created on
+                        # the shard and must not be overwritten.
+                        existing = {
+                            r._mapping[pk.name]: dict(r._mapping)
+                            for r in conn.execute(
+                                select(table).where(pk.in_([row[pk.name] for row in shard_rows]))
+                            )
+                        }
+                        clashes = [
+                            row[pk.name] for row in shard_rows
+                            if row[pk.name] in existing and existing[row[pk.name]] != row
+                        ]
+                        if clashes:
+                            raise RuntimeError(
+                                f"{table.name} ids {clashes[:10]} already exist on shard {shard} "
+                                "with different data"
+                            )
+                        new_rows = [row for row in shard_rows if row[pk.name] not in existing]
+                        if new_rows:
+                            conn.execute(insert(table), new_rows)
+                last = rows[-1][pk.name]
+                moved[table.name] += len(rows)
+
+        # Everything is on the shards now; clear the primary, children first.
+        for model in reversed(ALLOCATED_MODELS):
+            with db.engine.begin() as primary:
+                primary.execute(delete(model.__table__))
+
+        with db.engine.begin() as primary:
+            rebuild_treatment_stats(primary)
+        for key in self.keys:
+            with db.engines[key].begin() as conn:
+                rebuild_treatment_stats(conn)
+        self._seed_ids()
+        return moved
+
+    def _shard_treatment(self, conn, ids, catalog, tid):
+        # Primary catalog id -> the shard's id for the same normalized name.
+        if tid is None or tid not in catalog:
+            return None
+        if tid not in ids:
+            normalized, name = catalog[tid]
+            treatments = Treatment.__table__
+            ids[tid] = conn.scalar(
+                select(treatments.c.Treatment_ID).where(treatments.c.Normalized_Name == normalized)
+            ) or conn.execute(
+                insert(treatments).values(Name=name, Normalized_Name=normalized)
+            ).inserted_primary_key[0]
+        return ids[tid]
+
+    def _seed_ids(self):
+        # Moved rows keep their primary ids, which don't follow the shard
+        # pattern; every counter starts above the highest id on any database.
+        engines = [db.engine] + [db.engines[key] for key in self.keys]
+        for model in ALLOCATED_MODELS:
+            pk = model.__table__.primary_key.columns[0]
+            highest = 0
+            for engine in engines:
+                with engine.connect() as conn:
+                    highest = max(highest, conn.scalar(select(func.max(pk))) or 0)
+            used = highest // self.count
+            name = model.__tablename__
+            for key in self.keys:
+                with db.engines[key].begin() as conn:
+                    current = conn.scalar(
+                        select(id_sequences.c.Next_Value).where(id_sequences.c.Name == name)
+                    )
+                    if current is None:
+                        conn.execute(insert(id_sequences).values(Name=name, Next_Value=used))
+                    elif current < used:
+                        conn.execute(
+                            update(id_sequences)
+                            .where(id_sequences.c.Name == name)
+                            .values(Next_Value=used)
+                        )
+
+    def fan_out(self, fn):
+        # fn(session) runs once per shard, in parallel, each with its own
+        # short-lived session; results come back in shard order. Each task
+        # runs in a copy of the caller's context (request time budget).
+        if not self.enabled:
+            return [fn(db.session)]
+        tasks = [(self._open(shard), contextvars.copy_context()) for shard in range(self.count)]
+
+        def run(task):
+            session, context = task
+            with session:
+                return context.run(fn, session)
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.count, thread_name_prefix="hms-shard"
+                )
+        return list(self._executor.map(run, tasks))
+
+    def create_all(self):
+        for key in self.keys:
+            shard_metadata.create_all(db.engines[key])
+
+    def _close_sessions(self, exc):
+        for session in g.pop("shard_sessions", {}).values():
+            session.close()
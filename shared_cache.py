@@ -0,0 +1,181 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class SharedCache:
+    # A cache file shared by every worker process on the host. Entries are
+    # tagged with the generation of each table they were computed from; a
+    # write anywhere bumps the generation, so stale entries simply stop
+    # matching in all workers at once.
+
+    def __init__(self, path, ttl=30, maxsize=1024, lease_seconds=15, poll_interval=0.05,
+                 purge_interval=5.0):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._token = uuid.uuid4().hex
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self._connect().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                gens TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS generations (
+                table_name TEXT PRIMARY KEY,
+                gen INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            """
+        )
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forks.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @property
+    def owner(self):
+        return "%d:%s" % (os.getpid(), self._token)
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def generations(self, tables):
+        tables = sorted(tables)
+        if not tables:
+            return {}
+        rows = self._connect().execute(
+            "SELECT table_name, gen FROM generations WHERE table_name IN (%s)"
+            % ",".join("?" * len(tables)),
+            tables,
+        ).fetchall()
+        gens = dict.fromkeys(tables, 0)
+        gens.update(rows)
+        return gens
+
+    def bump(self, tables):
+        tables = list(tables)
+        if not tables:
+            return
+        self._connect().executemany(
+            "INSERT INTO generations (table_name, gen) VALUES (?, 1) "
+            "ON CONFLICT(table_name) DO UPDATE SET gen = gen + 1",
+            [(t,) for t in tables],
+        )
+
+    def get(self, key, gens):
+        row = self._connect().execute(
+            "SELECT value FROM entries WHERE key = ? AND gens = ? AND expires_at > ?",
+            (key, json.dumps(gens, sort_keys=True), time.time()),
+        ).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def set(self, key, value, gens):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO entries (key, gens, value, expires_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(gens, sort_keys=True), json.dumps(value), time.time() + self.ttl),
+        )
+        if time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + self.purge_interval
+            self.purge()
+
+    def purge(self):
+        # Expired entries (entries from older generations expire with them)
+        # go first; past maxsize, the entries closest to expiry go too.
+        conn = self._connect()
+        now = time.time()
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM entries WHERE key IN "
+            "(SELECT key FROM entries ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+
+    def acquire(self, key):
+        # Atomic set-if-absent on the lease row: exactly one worker wins.
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, self.owner, time.time() + self.lease_seconds),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount == 1
+
+    def release(self, key):
+        self._connect().execute(
+            "DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner)
+        )
+
+    def get_or_compute(self, key, tables, compute):
+        # Returns (value, gens). Whoever takes the lease computes; the other
+        # workers wait for its result instead of repeating the queries.
+        deadline = time.monotonic() + self.lease_seconds
+        waited = False
+        while True:
+            gens = self.generations(tables)
+            hit, value = self.get(key, gens)
+            if hit:
+                self._count("hits")
+                return value, gens
+            if self.acquire(key):
+                break
+            if not waited:
+                self._count("waits")
+                waited = True
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(self.poll_interval)
+
+        self._count("misses")
+        try:
+            value = compute()
+            if isinstance(value, dict):
+                self.set(key, value, gens)
+            return value, gens
+        finally:
+            self.release(key)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "path": self.path,
+                "entries": self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0],
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+            }
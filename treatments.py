@@ -0,0 +1,106 @@
+import threading
+
+from sqlalchemy import event, inspect, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from changefeed import change_row, record_changes
+from models import Bill, Treatment, normalize_treatment
+
+treatments = Treatment.__table__
+
+
+class TreatmentCatalog:
+    # (engine, normalized name) -> Treatment_ID, shared by all requests in
+    # the process; each shard numbers its own catalog. Ids for rows this
+    # process inserted are only published once their transaction commits, so
+    # a rollback cannot leave a dangling id cached.
+
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, session, name):
+        normalized = normalize_treatment(name)
+        if normalized is None:
+            return None
+        key = (session.get_bind(Treatment.__mapper__), normalized)
+        with self._lock:
+            tid = self._ids.get(key)
+        if tid is not None:
+            return tid
+        pending = session.info.setdefault("new_treatments", {})
+        if key in pending:
+            return pending[key]
+
+        conn = session.connection()
+        tid = conn.scalar(
+            select(treatments.c.Treatment_ID).where(treatments.c.Normalized_Name == normalized)
+        )
+        if tid is None:
+            try:
+                display = " ".join(name.split())
+                with conn.begin_nested():
+                    tid = conn.execute(
+                        insert(treatments).values(Name=display, Normalized_Name=normalized)
+                    ).inserted_primary_key[0]
+                record_changes(session, [change_row(
+                    "TREATMENT", tid, "insert",
+                    {"Treatment_ID": tid, "Name": display, "Normalized_Name": normalized}
+                )])
+                pending[key] = tid
+                return tid
+            except IntegrityError:
+                # Another transaction created it first. A locking read sees
+                # its committed row even under REPEATABLE READ, where a plain
+                # SELECT would reuse this transaction's snapshot.
+                tid = conn.scalar(
+                    select(treatments.c.Treatment_ID)
+                    .where(treatments.c.Normalized_Name == normalized)
+                    .with_for_update()
+                )
+                if tid is None:
+                    raise
+
+        with self._lock:
+            self._ids[key] = tid
+        return tid
+
+    def publish(self, ids):
+        with self._lock:
+            self._ids.update(ids)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+treatment_catalog = TreatmentCatalog()
+
+
+def _before_flush(session, flush_context, instances):
+    # Bills written outside create_bill still get their catalog id.
+    for obj in session.new:
+        if isinstance(obj, Bill) and obj.Treatment_ID is None:
+            obj.Treatment_ID = treatment_catalog.resolve(session, obj.Treatment)
+    for obj in session.dirty:
+        if not isinstance(obj, Bill):
+            continue
+        attrs = inspect(obj).attrs
+        if attrs.Treatment.history.has_changes() and not attrs.Treatment_ID.history.has_changes():
+            obj.Treatment_ID = treatment_catalog.resolve(session, obj.Treatment)
+
+
+def _after_commit(session):
+    treatment_catalog.publish(session.info.pop("new_treatments", {}))
+
+
+def _after_rollback(session):
+    session.info.pop("new_treatments", None)
+
+
+def init_treatments():
+    if not event.contains(Session, "before_flush", _before_flush):
+        event.listen(Session, "before_flush", _before_flush)
+        event.listen(Session, "after_commit", _after_commit)
+        event.listen(Session, "after_rollback", _after_rollback)
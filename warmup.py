@@ -0,0 +1,57 @@
+import time
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
+
+from models import (
+    db, Patient, Doctor, Nurse, Receptionist, Employee,
+    Bill, Visit, Recommendation, Schedule, Room, Medication
+)
+
+# Lookups on the per-request hot paths (session.get for the detail and update
+# handlers). Running each once against an id that cannot exist puts its
+# compiled form in the engine's statement cache.
+PK_LOOKUPS = (Patient, Doctor, Nurse, Receptionist, Room, Employee)
+PATIENT_SCOPED = (Bill, Visit, Recommendation, Medication)
+
+
+def _hot_statements():
+    for model in PATIENT_SCOPED:
+        yield select(model).where(model.Patient_ID == -1)
+    yield select(Schedule).where(Schedule.Employee_ID == -1)
+
+
+def warm_up(app):
+    # Runs inside create_app, before the worker accepts traffic.
+    started = time.perf_counter()
+    configure_mappers()
+
+    with app.app_context():
+        engine = db.engine
+        pool_size = getattr(engine.pool, "size", lambda: 1)()
+        connections = []
+        try:
+            for _ in range(min(app.config["WARMUP_CONNECTIONS"], pool_size)):
+                connections.append(engine.connect())
+        except SQLAlchemyError as e:
+            # Database unreachable: the worker still boots and serves
+            # /api/health; connections are opened on first use instead.
+            app.logger.warning("warm-up skipped: database unreachable: %s", e.orig or e)
+            app.config["WARMUP_SECONDS"] = round(time.perf_counter() - started, 4)
+            return
+        finally:
+            for conn in connections:
+                conn.close()
+
+        try:
+            for model in PK_LOOKUPS:
+                db.session.get(model, -1)
+            for stmt in _hot_statements():
+                db.session.execute(stmt).all()
+        except SQLAlchemyError:
+            # Tables not created yet; mappers and the pool are warm regardless.
+            db.session.rollback()
+            app.logger.warning("warm-up skipped statement cache: tables missing")
+
+    app.config["WARMUP_SECONDS"] = round(time.perf_counter() - started, 4)